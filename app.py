@@ -1,10 +1,15 @@
+from collections import OrderedDict
+
 import streamlit as st
-from risk_model import AMDRiskModel
+from risk_model import ModelRegistry
 from utils import legend, DISPLAY_NAMES
 
 # --- Configuration ---
 RESULTS_DIR = 'Influence Scores/' 
 TARGET_LABEL = 'ASMULTIMODALORRES_E1_C18'
+HORIZON_FEATURE = 'age_E1'
+SCENARIO_CACHE_SIZE = 32 # Precomputed profiles kept per session
+TOP_CHANGES = 10
 
 # --- DEFAULT PATIENT PROFILE ---
 DEFAULT_PROFILE = {
@@ -49,6 +54,65 @@ CUTOFF_DISPLAY_MAP = {
     3: "4"
 }
 
+# --- SCENARIO GRID ---
+def precompute_scenarios(model, profile):
+    """
+    Scores, in one batch, every single-variable change of SIMULATION_VARIABLES
+    (including "Unknown") at every HORIZON_FEATURE state.
+    
+    Returns:
+        dict: {horizon state: {'baseline': risk, 'changes': {(feature, state): risk}}}
+    """
+    keys, profiles = [], []
+    for horizon in legend[HORIZON_FEATURE]:
+        base = dict(profile, **{HORIZON_FEATURE: horizon})
+        keys.append((horizon, None))
+        profiles.append(base)
+        for feature in SIMULATION_VARIABLES:
+            for state in legend[feature]:
+                keys.append((horizon, (feature, state)))
+                profiles.append(dict(base, **{feature: state}))
+
+    grid = {horizon: {'baseline': None, 'changes': {}} for horizon in legend[HORIZON_FEATURE]}
+    for (horizon, change), risk in zip(keys, model.calculate_risk_batch(profiles, legend).tolist()):
+        if change is None:
+            grid[horizon]['baseline'] = risk
+        else:
+            grid[horizon]['changes'][change] = risk
+    return grid
+
+def scenario_grid(model, profile):
+    """
+    Scenario grid of a baseline profile from the session cache (keyed by cutoff
+    and profile without the horizon), computed inline on a miss: one batch call
+    takes well under a millisecond. A failed computation is not cached.
+    """
+    key = (model.amd_cutoff, tuple(sorted((f, v) for f, v in profile.items() if f != HORIZON_FEATURE)))
+    cache = st.session_state.setdefault('scenario_cache', OrderedDict())
+    grid = cache.get(key)
+    if grid is None:
+        grid = precompute_scenarios(model, profile)
+        cache[key] = grid
+        while len(cache) > SCENARIO_CACHE_SIZE:
+            cache.popitem(last=False)
+    else:
+        cache.move_to_end(key)
+    return grid
+
+def ranked_changes(scenarios, profile):
+    """Single-variable changes to a known state that lower the risk, most effective first."""
+    rows = []
+    for (feature, state), risk in scenarios['changes'].items():
+        current = profile.get(feature, -1)
+        delta = risk - scenarios['baseline']
+        if state == current or state == -1 or delta >= 0:
+            continue
+        labels = {**legend[feature], -1: "Unknown"}
+        rows.append({'Change': DISPLAY_NAMES.get(feature, feature), 'From': labels.get(current, str(current)),
+                     'To': labels[state], 'Risk': format_risk(risk), 'Delta': format_risk(delta), '_delta': delta})
+    rows.sort(key=lambda row: row['_delta'])
+    return [{k: v for k, v in row.items() if k != '_delta'} for row in rows]
+
 # --- HELPER: 2 SIGNIFICANT DIGITS ---
 def format_risk(val):
     if val == 0: return "0.00"
@@ -60,15 +124,12 @@ def main():
     st.title("AMD Risk Score Calculator")
     #st.markdown("Use the sidebar to set **Genetics & History**. Set the **Target Age** below to calculate risk.")
 
-    # 1. Initialize Model
+    # 1. Initialize Models (one per AMD cutoff, loaded on first use)
     @st.cache_resource
-    def get_model():
-        default_cutoff = DEFAULT_PROFILE.get('stage_before', 3)
-        model = AMDRiskModel(results_path=RESULTS_DIR, amd_cutoff=default_cutoff) 
-        model.load_model(label_col=TARGET_LABEL)
-        return model
+    def get_registry():
+        return ModelRegistry(results_path=RESULTS_DIR, label_col=TARGET_LABEL)
 
-    model = get_model()
+    registry = get_registry()
 
     # --- SIDEBAR: GENETICS & HISTORY (V0) ---
     st.sidebar.header("1. Patient Profile")
@@ -89,7 +150,7 @@ def main():
     
     stage_id = [k for k, v in stage_options.items() if v == stage_label][0]
     user_profile['stage_before'] = stage_id
-    model.amd_cutoff = stage_id
+    model = registry.for_stage(stage_id)
 
     # 1B. Handle Features
     v0_keys = list(V0_TO_V1_MAP.keys())
@@ -127,6 +188,9 @@ def main():
         if v0_key in user_profile:
             user_profile[v1_key] = user_profile[v0_key]
 
+    # Every what-if change and horizon of this profile, scored once per session
+    grid = scenario_grid(model, user_profile)
+
     # --- MAIN PANEL ---
 
     # 2. PREDICTION HORIZON
@@ -163,7 +227,8 @@ def main():
     st.divider()
 
     # 3. RESULTS & SIMULATION
-    baseline_score = model.calculate_risk(user_profile, legend)
+    scenarios = grid[user_profile[age_feature]]
+    baseline_score = scenarios['baseline']
     
     col_base, col_sim = st.columns([1, 2])
     
@@ -183,6 +248,16 @@ def main():
             help=f"Assuming the patient profile is unchanged."
         )
 
+        # Every transition band from one stacked pass over all cutoffs
+        multi = registry.multi_cutoff()
+        with st.expander("All stage transitions"):
+            for cutoff, risk in zip(multi.cutoffs, multi.calculate_risk(user_profile, legend)):
+                st.markdown(f"**{CUTOFF_DISPLAY_MAP.get(cutoff, str(cutoff))}**: {format_risk(risk)}")
+
+        # Risk at every prediction horizon, the rest of the profile unchanged
+        st.caption(f"Risk by {display_name}")
+        st.bar_chart({'Risk Score': {lbl: grid[h]['baseline'] for h, lbl in legend[age_feature].items() if h != -1}})
+
     with col_sim:
         st.subheader("3. Risk After Changes")
         st.markdown("Adjust future changes.")
@@ -215,7 +290,12 @@ def main():
             submit = st.form_submit_button("Run Simulation", type="primary")
 
         if submit:
-            sim_score = model.calculate_risk(cf_profile, legend)
+            changes = {f: cf_profile[f] for f in SIMULATION_VARIABLES if cf_profile[f] != user_profile.get(f)}
+            if len(changes) <= 1:
+                # Single-variable changes were precomputed
+                sim_score = scenarios['changes'][next(iter(changes.items()))] if changes else baseline_score
+            else:
+                sim_score = model.rescore(model.infer(user_profile, legend), changes).risk
             delta = sim_score - baseline_score
             
             f_sim_score = format_risk(sim_score)
@@ -241,5 +321,14 @@ def main():
                 else:
                     st.info("No significant change in risk.")
 
+    # 4. RANKED CHANGES (already scored with the grid)
+    st.divider()
+    st.subheader("4. Most Effective Changes")
+    top_changes = ranked_changes(scenarios, user_profile)[:TOP_CHANGES]
+    if top_changes:
+        st.dataframe(top_changes, hide_index=True, use_container_width=True)
+    else:
+        st.info("No single change lowers the risk for this profile.")
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
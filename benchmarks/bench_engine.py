@@ -0,0 +1,342 @@
+"""
+Benchmarks for the VIA engine and the risk model hot paths.
+
+Run from the repository root:
+
+    python benchmarks/bench_engine.py --output bench.json
+    python benchmarks/bench_engine.py --compare bench.json --threshold 1.25
+
+Results are written as JSON. With --compare, any timing slower than the
+baseline by more than --threshold is reported and the exit code is 1.
+Correctness (exact vs iterative BP, log-domain stability) is checked by the
+tests in tests/.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from via.engine import (generate_graph_weights, initiate_bp_messages, run_belief_propagation,
+                        run_belief_propagation_vectorized, run_inference)
+from via.graph import FactorGraph
+
+RESULTS_DIR = os.path.join(ROOT, 'Influence Scores')
+TARGET_LABEL = 'ASMULTIMODALORRES_E1_C18'
+
+
+# --- Timing Helpers ---
+
+def _time(fn, repeat=5, number=None, budget=0.2):
+    """Median and best seconds per call; `number` is calibrated to ~budget/repeat if not given."""
+    if number is None:
+        number = 1
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        if elapsed > 0:
+            number = max(1, int(budget / repeat / elapsed))
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) / number)
+    return {'median_s': statistics.median(samples), 'min_s': min(samples), 'calls': number * repeat}
+
+
+def synthetic_star(n_features, n_states, seed=0):
+    """Star graph like the model's, with random weights and one clamped state per feature."""
+    rng = np.random.default_rng(seed)
+    nV = n_features + 1
+    N, Nf, t, q, vf, fv = generate_graph_weights(nV)
+    nv = {i: n_states for i in range(1, nV)}
+    nv[nV] = 2
+
+    vm = {}
+    for f in range(1, Nf + 1):
+        if len(fv[f]) == 2:
+            vm[f] = rng.uniform(0.05, 0.95, size=(n_states, 2))
+        else:
+            i = fv[f][0]
+            vm[f] = np.ones((nv[i], 1))
+            if i != nV:
+                vm[f][:] = 0.0
+                vm[f][rng.integers(nv[i])] = 1.0
+    return N, Nf, fv, vf, vm, nv
+
+
+def synthetic_loopy(n_features, n_states, n_interactions, strength, seed=0):
+    """Star graph plus random feature-feature factors with log-normal potentials of `strength`."""
+    rng = np.random.default_rng(seed)
+    nV = n_features + 1
+    pairs = set()
+    while len(pairs) < n_interactions:
+        a, b = sorted(rng.choice(np.arange(1, nV), 2, replace=False))
+        pairs.add((int(a), int(b)))
+    N, Nf, t, q, vf, fv = generate_graph_weights(nV, interactions=sorted(pairs))
+    nv = {i: n_states for i in range(1, nV)}
+    nv[nV] = 2
+
+    vm = {}
+    for f in range(1, Nf + 1):
+        if len(fv[f]) == 2:
+            vm[f] = np.exp(strength * rng.normal(size=(nv[fv[f][0]], nv[fv[f][1]])))
+        else:
+            vm[f] = rng.uniform(0.2, 1.0, size=(nv[fv[f][0]], 1))
+    return N, Nf, fv, vf, vm, nv
+
+
+# --- Benchmarks ---
+
+def bench_graph(results):
+    results['generate_graph_weights[nV=24]'] = _time(lambda: generate_graph_weights(24))
+    for nV in (24, 10000):
+        results[f'FactorGraph.star[nV={nV}]'] = _time(lambda: FactorGraph.star(np.full(nV, 3)))
+    N, Nf, t, q, vf, fv = generate_graph_weights(10000)
+    nv = {i: 3 for i in range(1, N + 1)}
+    results['FactorGraph.from_dicts[nV=10000]'] = _time(lambda: FactorGraph.from_dicts(N, Nf, fv, nv), repeat=3)
+
+    N, Nf, fv, vf, vm, nv = synthetic_star(23, 3)
+    results['initiate_bp_messages[nV=24]'] = _time(lambda: initiate_bp_messages(N, Nf, vf, fv, vm, nv))
+
+
+def bench_bp(results):
+    N, Nf, fv, vf, vm, nv = synthetic_star(23, 3)
+    for name, engine in [('run_belief_propagation', run_belief_propagation),
+                         ('run_belief_propagation_vectorized', run_belief_propagation_vectorized)]:
+        def run():
+            nuja0, nuaj0 = initiate_bp_messages(N, Nf, vf, fv, vm, nv)
+            return engine(N, Nf, fv, vf, nuja0, nuaj0, 1e-7, 1000, vm, nv)
+        n_iter = run()[3]
+        timing = _time(run)
+        timing['n_iter'] = n_iter
+        timing['per_iter_s'] = timing['median_s'] / max(n_iter, 1)
+        results[f'{name}[nV=24]'] = timing
+
+
+def bench_load_model(results):
+    from risk_model import AMDRiskModel
+    with tempfile.TemporaryDirectory() as xlsx_dir, tempfile.TemporaryDirectory() as cache_dir:
+        for cutoff in range(4):
+            name = f'InfluenceScores_fixedSate1_AMD_cutoff{cutoff}'
+            model = AMDRiskModel(results_path=RESULTS_DIR, amd_cutoff=cutoff)
+            results[f'load_model[cutoff={cutoff},binary]'] = _time(
+                lambda: model.load_model(label_col=TARGET_LABEL), repeat=3)
+
+            # Without a .via file: the first load parses the xlsx and fills the empty cache; later loads hit it
+            shutil.copy(os.path.join(RESULTS_DIR, name + '.xlsx'), xlsx_dir)
+            model = AMDRiskModel(results_path=xlsx_dir, amd_cutoff=cutoff)
+            start = time.perf_counter()
+            model.load_model(label_col=TARGET_LABEL, cache_dir=cache_dir)
+            results[f'load_model[cutoff={cutoff},cold]'] = {'median_s': time.perf_counter() - start, 'calls': 1}
+            results[f'load_model[cutoff={cutoff},cached]'] = _time(
+                lambda: model.load_model(label_col=TARGET_LABEL, cache_dir=cache_dir), repeat=3)
+
+
+def bench_calculate_risk(results):
+    from risk_model import AMDRiskModel, ModelRegistry
+    model = AMDRiskModel(results_path=RESULTS_DIR, amd_cutoff=1)
+    model.load_model(label_col=TARGET_LABEL)
+    profiles = random_profiles(model, 100000)
+
+    results['calculate_risk[single]'] = _time(lambda: model.calculate_risk(profiles[0]))
+    for n in (1000, 100000):
+        batch = profiles[:n]
+        timing = _time(lambda: model.calculate_risk_batch(batch), repeat=3)
+        timing['patients_per_s'] = n / timing['median_s']
+        results[f'calculate_risk_batch[list,n={n}]'] = timing
+    results['calculate_risk[single,contributions]'] = _time(lambda: model.calculate_risk(profiles[0], contributions=True))
+    timing = _time(lambda: model.calculate_risk_batch(profiles, contributions=True), repeat=3)
+    timing['patients_per_s'] = len(profiles) / timing['median_s']
+    results[f'calculate_risk_batch[list,contributions,n={len(profiles)}]'] = timing
+
+    timing = _time(lambda: model.risk_curve_batch(profiles, 'age_E1'), repeat=3)
+    timing['patients_per_s'] = len(profiles) / timing['median_s']
+    results[f'risk_curve_batch[age_E1,n={len(profiles)}]'] = timing
+
+    ensemble = model.sample_weight_ensemble(200, seed=0)
+    batch = profiles[:10000]
+    timing = _time(lambda: model.calculate_risk_ensemble(batch, ensemble=ensemble), repeat=3)
+    timing['patients_per_s'] = len(batch) / timing['median_s']
+    results[f'calculate_risk_ensemble[replicates=200,n={len(batch)}]'] = timing
+
+    # Every cutoff: one stacked pass against one batch call per model
+    registry = ModelRegistry(results_path=RESULTS_DIR, label_col=TARGET_LABEL)
+    multi = registry.multi_cutoff()
+    timing = _time(lambda: multi.calculate_risk_batch(profiles), repeat=3)
+    timing['patients_per_s'] = len(profiles) / timing['median_s']
+    results[f'multi_cutoff_batch[stacked,n={len(profiles)}]'] = timing
+    timing = _time(lambda: [m.calculate_risk_batch(profiles) for m in multi.models], repeat=3)
+    timing['patients_per_s'] = len(profiles) / timing['median_s']
+    results[f'multi_cutoff_batch[per_model,n={len(profiles)}]'] = timing
+
+    try:
+        import pandas as pd
+    except ImportError:
+        return
+    frame = pd.DataFrame(profiles)
+    timing = _time(lambda: model.calculate_risk_batch(frame), repeat=3)
+    timing['patients_per_s'] = len(frame) / timing['median_s']
+    results[f'calculate_risk_batch[dataframe,n={len(frame)}]'] = timing
+
+
+def bench_scaling(results):
+    """Engine cost on synthetic stars beyond the 23 features of the shipped model."""
+    for n_features in (23, 100, 500):
+        for n_states in (3, 5, 10):
+            N, Nf, fv, vf, vm, nv = synthetic_star(n_features, n_states)
+            key = f'[features={n_features},states={n_states}]'
+            results['run_inference' + key] = _time(lambda: run_inference(N, Nf, fv, vf, vm, nv), repeat=3)
+
+            def loopy():
+                nuja0, nuaj0 = initiate_bp_messages(N, Nf, vf, fv, vm, nv)
+                return run_belief_propagation_vectorized(N, Nf, fv, vf, nuja0, nuaj0, 1e-7, 1000, vm, nv)
+            results['run_belief_propagation_vectorized' + key] = _time(loopy, repeat=3)
+
+            if n_features <= 100: # The dict engine is too slow to sweep further
+                def reference():
+                    nuja0, nuaj0 = initiate_bp_messages(N, Nf, vf, fv, vm, nv)
+                    return run_belief_propagation(N, Nf, fv, vf, nuja0, nuaj0, 1e-7, 1000, vm, nv)
+                results['run_belief_propagation' + key] = _time(reference, repeat=3)
+
+
+def bench_factor_arity(results):
+    """Dict engine on a small star plus one factor joining all features, as the factor arity grows."""
+    rng = np.random.default_rng(0)
+    for arity in (2, 4, 6):
+        N, Nf, fv, vf, vm, nv = synthetic_star(arity, 4)
+        Nf += 1
+        fv[Nf] = list(range(1, arity + 1))
+        for i in fv[Nf]:
+            vf[i].append(Nf)
+        vm[Nf] = rng.uniform(0.1, 1.0, size=[nv[i] for i in fv[Nf]])
+
+        def run():
+            nuja0, nuaj0 = initiate_bp_messages(N, Nf, vf, fv, vm, nv)
+            return run_belief_propagation(N, Nf, fv, vf, nuja0, nuaj0, 1e-7, 10, vm, nv)
+        results[f'run_belief_propagation[arity={arity},states=4]'] = _time(run, repeat=3)
+
+
+def bench_schedules(results):
+    """Flooding vs damped flooding vs residual BP on loopy graphs (mild and frustrated couplings)."""
+    schedules = [
+        ('flooding', {}),
+        ('flooding_damped', {'damping': 0.5}),
+        ('residual', {'schedule': 'residual'}),
+    ]
+    # The seeds of the strongly coupled graphs are ones where undamped flooding oscillates
+    for n_features, n_states, n_interactions, strength, seed in [(23, 3, 10, 1.0, 0), (12, 2, 30, 4.0, 1),
+                                                                 (8, 2, 12, 5.0, 3)]:
+        N, Nf, fv, vf, vm, nv = synthetic_loopy(n_features, n_states, n_interactions, strength, seed=seed)
+        key = f'[features={n_features},interactions={n_interactions},strength={strength},seed={seed}]'
+        for name, kwargs in schedules:
+            def run():
+                return run_inference(N, Nf, fv, vf, vm, nv, precision=1e-8, max_iter=1000, topology='loopy', **kwargs)
+            _, _, _, n_iter, error = run()
+            timing = _time(run, repeat=3, number=1)
+            timing.update({'n_iter': n_iter, 'error': error, 'converged': error <= 1e-8})
+            results[f'schedule_{name}' + key] = timing
+
+
+def bench_log_domain(results):
+    """Linear vs log-domain flooding on wide loopy graphs; 'underflow' means the target marginal came out all zero."""
+    for n_features in (100, 1500):
+        N, Nf, fv, vf, vm, nv = synthetic_loopy(n_features, 3, n_features // 2, 0.5, seed=1)
+        key = f'[features={n_features},interactions={n_features // 2}]'
+        for name, log_domain in [('flooding', False), ('flooding_log', True)]:
+            def run():
+                with np.errstate(all='ignore'):
+                    return run_inference(N, Nf, fv, vf, vm, nv, precision=1e-8, max_iter=1000, topology='loopy',
+                                         log_domain=log_domain)
+            _, _, marginals, n_iter, error = run()
+            timing = _time(run, repeat=3, number=1)
+            timing.update({'n_iter': n_iter, 'error': error, 'underflow': not np.any(marginals[N] > 0)})
+            results[f'schedule_{name}' + key] = timing
+
+
+def random_profiles(model, n, seed=0):
+    """Random profiles over the model's features, with ~10% of values unobserved."""
+    rng = np.random.default_rng(seed)
+    features = model.header_1[:-1]
+    ids = np.column_stack([rng.integers(0, model.node_states[f], size=n) for f in features])
+    ids[rng.random(ids.shape) < 0.1] = -1
+    return [dict(zip(features, row.tolist())) for row in ids]
+
+
+BENCHMARKS = {
+    'graph': bench_graph,
+    'bp': bench_bp,
+    'load_model': bench_load_model,
+    'calculate_risk': bench_calculate_risk,
+    'scaling': bench_scaling,
+    'factor_arity': bench_factor_arity,
+    'schedules': bench_schedules,
+    'log_domain': bench_log_domain,
+}
+
+
+# --- Reporting ---
+
+def compare(results, baseline, threshold):
+    """Names whose median time grew by more than `threshold` times the baseline."""
+    regressions = []
+    for name, timing in results.items():
+        old = baseline.get(name)
+        if old and 'median_s' in old and 'median_s' in timing and old['median_s'] > 0:
+            ratio = timing['median_s'] / old['median_s']
+            if ratio > threshold:
+                regressions.append((name, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the VIA engine and AMDRiskModel.")
+    parser.add_argument('--output', help="Write results to this JSON file (default: stdout)")
+    parser.add_argument('--only', nargs='*', choices=sorted(BENCHMARKS), help="Run only these groups")
+    parser.add_argument('--compare', help="Baseline JSON from a previous run")
+    parser.add_argument('--threshold', type=float, default=1.25, help="Slowdown ratio flagged as a regression")
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.only or BENCHMARKS:
+        print(f"Running {name}...", file=sys.stderr)
+        BENCHMARKS[name](results)
+
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as fh:
+            fh.write(text + '\n')
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for name, ratio in regressions:
+            print(f"REGRESSION {name}: {ratio:.2f}x slower", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
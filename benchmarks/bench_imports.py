@@ -0,0 +1,62 @@
+"""
+Import-time benchmark.
+
+Each module is imported in a fresh interpreter with `python -X importtime`,
+and its cumulative import time and module count are reported:
+
+    python benchmarks/bench_imports.py --output imports.json
+
+That the scoring path imports no pandas is checked by tests/test_imports.py.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = ['numpy', 'via.engine', 'model_format', 'risk_model', 'serve', 'main', 'score_cohort', 'pandas']
+
+
+def import_time(module, repeat=5):
+    """Median cumulative import time (seconds) of `module` and the number of modules it loaded."""
+    samples = []
+    n_modules = 0
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=ROOT,
+                              capture_output=True, text=True, check=True)
+        lines = [line for line in proc.stderr.splitlines() if line.startswith('import time:') and '|' in line]
+        for line in lines:
+            _, cumulative, name = line.split('|')
+            if name.strip() == module and not name[1:].startswith(' '): # Top-level entry
+                samples.append(int(cumulative) / 1e6)
+        n_modules = len(lines) - 1 # Minus the header line
+    return {'median_s': statistics.median(samples), 'min_s': min(samples), 'modules': n_modules}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark import times of the package modules.")
+    parser.add_argument('--repeat', type=int, default=5, help="Fresh interpreters per module")
+    parser.add_argument('--output', help="Write results to this JSON file (default: stdout)")
+    args = parser.parse_args()
+
+    results = {}
+    for module in MODULES:
+        print(f"Importing {module}...", file=sys.stderr)
+        try:
+            results[f'import[{module}]'] = import_time(module, args.repeat)
+        except subprocess.CalledProcessError as exc:
+            results[f'import[{module}]'] = {'error': exc.stderr.strip().splitlines()[-1]}
+
+    text = json.dumps({'python': sys.version.split()[0], 'results': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as fh:
+            fh.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Load test for the HTTP scoring service (serve.py), with a local client only.
+
+Starts the service in-process on a free port, then keeps --concurrency
+keep-alive connections busy with single-profile /score requests and reports
+throughput and client-side latency percentiles per micro-batching setting:
+
+    python benchmarks/bench_service.py --requests 20000 --concurrency 64
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_engine import RESULTS_DIR, TARGET_LABEL, random_profiles
+from risk_model import ModelRegistry
+from serve import ScoringService
+
+
+async def _client(host, port, bodies, latencies):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for body in bodies:
+            start = time.perf_counter()
+            writer.write(b"POST /score HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+                         b"Content-Length: %d\r\n\r\n%s" % (len(body), body))
+            await writer.drain()
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b''):
+                    break
+                if line.lower().startswith(b'content-length:'):
+                    length = int(line.split(b':', 1)[1])
+            response = json.loads(await reader.readexactly(length))
+            if 'risk' not in response:
+                raise RuntimeError(f"Scoring failed: {response}")
+            latencies.append(time.perf_counter() - start)
+    finally:
+        writer.close()
+
+
+async def run_load(registry, profiles, concurrency, max_batch_size, max_wait_ms):
+    service = ScoringService(registry, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+    host, port = await service.start('127.0.0.1', 0)
+    bodies = [json.dumps({'profile': p, 'cutoff': 1}).encode() for p in profiles]
+    latencies = []
+    try:
+        start = time.perf_counter()
+        await asyncio.gather(*[_client(host, port, bodies[k::concurrency], latencies) for k in range(concurrency)])
+        elapsed = time.perf_counter() - start
+        metrics = service.metrics.snapshot()
+    finally:
+        await service.stop()
+
+    latencies = np.array(latencies) * 1000
+    return {
+        'requests_per_s': len(latencies) / elapsed,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'mean_batch_size': metrics['mean_batch_size'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the micro-batching scoring service.")
+    parser.add_argument('--requests', type=int, default=20000, help="Total /score requests per setting")
+    parser.add_argument('--concurrency', type=int, default=64, help="Concurrent keep-alive connections")
+    parser.add_argument('--output', help="Write results to this JSON file (default: stdout)")
+    args = parser.parse_args()
+
+    registry = ModelRegistry(results_path=RESULTS_DIR, label_col=TARGET_LABEL)
+    profiles = random_profiles(registry.get(1), args.requests)
+
+    results = {}
+    # Batch size 1 is the no-batching baseline
+    for max_batch_size, max_wait_ms in [(1, 0.0), (64, 0.0), (64, 2.0)]:
+        key = f'service[batch={max_batch_size},wait_ms={max_wait_ms},concurrency={args.concurrency}]'
+        print(f"Running {key}...", file=sys.stderr)
+        results[key] = asyncio.run(run_load(registry, profiles, args.concurrency, max_batch_size, max_wait_ms))
+
+    text = json.dumps({'results': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as fh:
+            fh.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
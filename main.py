@@ -1,4 +1,3 @@
-import pandas as pd
 from risk_model import AMDRiskModel
 from utils import legend, DISPLAY_NAMES
 
@@ -48,15 +47,16 @@ def main():
     
     # 2. Compute Risk Score
     print("Computing risk score...")
-    score = model.calculate_risk(patient_profile, legend)
+    baseline = model.infer(patient_profile, legend)
+    score = baseline.risk
     
     print(f"\n--- Results ---")
     print(f"Patient Profile: {patient_profile}")
     print(f"Calculated AMD Risk Score: {score:.4f}")
     
     # 3. Counterfactual Example (What if it did exercise?)
-    patient_profile['lh_phy_exercise_E1_C6'] = 1
-    score_improved = model.calculate_risk(patient_profile, legend)
+    # Only the changed feature's message is recomputed from the baseline
+    score_improved = model.rescore(baseline, {'lh_phy_exercise_E1_C6': 1}).risk
     print(f"Risk Score if she did exercise: {score_improved:.4f}")
 
 
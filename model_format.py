@@ -0,0 +1,220 @@
+"""
+Versioned binary format for influence score models (.via files).
+
+Layout (little-endian):
+
+    offset 0    8 bytes   magic b'VIAMODEL'
+    offset 8    uint32    format version
+    offset 12   uint32    length of the JSON header in bytes
+    offset 16   JSON      features, cardinality (states per feature), states
+                          (labels, feature by feature), weight_columns, source
+                          file name, SHA-256, mtime and size
+    aligned     float64   (n_events, 4) weight block in C order, 8-byte aligned
+
+Loading memory-maps the weight block with `np.memmap`, so processes that load
+the same file share one page-cache copy, and needs only NumPy. The xlsx files
+stay the editable source; convert them after every change with
+
+    python model_format.py "Influence Scores/"
+
+which writes one .via next to each xlsx and checks that it reads back equal.
+A .via whose xlsx has changed since (see `source_matches`) is not loaded.
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import struct
+import sys
+
+import numpy as np
+
+MAGIC = b'VIAMODEL'
+FORMAT_VERSION = 1
+MODEL_SUFFIX = '.via'
+WEIGHT_COLUMNS = ['0_x=0', '0_x=1', '1_x=0', '1_x=1']
+
+_PREAMBLE = struct.Struct('<8sII')
+_DTYPE = np.dtype('<f8')
+
+
+def write_model_file(path, features, states, weights, source=None):
+    """
+    Writes a model file atomically.
+
+    `features` and `states` name each event (row of `weights`), as returned by
+    `read_influence_xlsx`; the events of a feature must be contiguous.
+    `weights` is (n_events, 4), ordered as WEIGHT_COLUMNS. `source` is the
+    path of the file it was converted from, recorded with its SHA-256, mtime
+    and size.
+    """
+    weights = np.ascontiguousarray(weights, dtype=_DTYPE)
+    if weights.shape != (len(features), len(WEIGHT_COLUMNS)) or len(states) != len(features):
+        raise ValueError(f"Expected {len(features)} events of {len(WEIGHT_COLUMNS)} weights, got {weights.shape}")
+
+    names, cardinality = [], []
+    for feature in features:
+        if names and names[-1] == feature:
+            cardinality[-1] += 1
+        elif feature in names:
+            raise ValueError(f"Events of feature {feature!r} are not contiguous")
+        else:
+            names.append(feature)
+            cardinality.append(1)
+
+    header = {
+        'features': names,
+        'cardinality': cardinality,
+        'states': list(states),
+        'weight_columns': WEIGHT_COLUMNS,
+        'dtype': _DTYPE.str,
+    }
+    if source is not None:
+        stat = os.stat(source)
+        header['source'] = os.path.basename(source)
+        header['source_sha256'] = file_sha256(source)
+        header['source_mtime_ns'] = stat.st_mtime_ns
+        header['source_size'] = stat.st_size
+    header_bytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    data_offset = _data_offset(len(header_bytes))
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as fh:
+        fh.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header_bytes)))
+        fh.write(header_bytes)
+        fh.write(b'\0' * (data_offset - _PREAMBLE.size - len(header_bytes)))
+        fh.write(weights.tobytes())
+    os.replace(tmp_path, path)
+
+
+def read_model_file(path):
+    """
+    Returns (features, states, weights, header) for a model file.
+
+    `features` and `states` are per event, like `read_influence_xlsx`, and
+    `weights` is a read-only (n_events, 4) memory map of the weight block.
+    Raises ValueError for files that are not models or have a newer version.
+    """
+    with open(path, 'rb') as fh:
+        preamble = fh.read(_PREAMBLE.size)
+        if len(preamble) < _PREAMBLE.size:
+            raise ValueError(f"{path} is not a VIA model file")
+        magic, version, header_size = _PREAMBLE.unpack(preamble)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a VIA model file")
+        if version > FORMAT_VERSION:
+            raise ValueError(f"{path} has format version {version}; this reader supports up to {FORMAT_VERSION}")
+        header = json.loads(fh.read(header_size).decode('utf-8'))
+
+    cardinality = header['cardinality']
+    n_events = sum(cardinality)
+    if len(header['states']) != n_events:
+        raise ValueError(f"{path}: {len(header['states'])} state labels for {n_events} events")
+    features = [name for name, n in zip(header['features'], cardinality) for _ in range(n)]
+
+    shape = (n_events, len(header['weight_columns']))
+    offset = _data_offset(header_size)
+    if os.path.getsize(path) != offset + shape[0] * shape[1] * _DTYPE.itemsize:
+        raise ValueError(f"{path}: weight block does not match {n_events} events")
+    if n_events == 0:
+        weights = np.empty(shape, dtype=_DTYPE)
+    else:
+        weights = np.memmap(path, dtype=np.dtype(header['dtype']), mode='r', offset=offset, shape=shape)
+    return features, list(header['states']), weights, header
+
+
+def read_influence_xlsx(path):
+    """(features, states, weights) from an influence score Excel file (needs pandas and openpyxl)."""
+    import pandas as pd
+    data = pd.read_excel(path)
+    features = []
+    states = []
+    for h in data['event'].values:
+        cut = h.find(':')
+        features.append(h[0:cut])
+        states.append(h[cut+1:])
+    return features, states, data[WEIGHT_COLUMNS].to_numpy(dtype=np.float64)
+
+
+def source_matches(header, source_path):
+    """
+    Whether `source_path` is the file a model was converted from: same mtime and
+    size, or failing that (e.g. a fresh checkout) the same SHA-256.
+    """
+    stat = os.stat(source_path)
+    if header.get('source_mtime_ns') == stat.st_mtime_ns and header.get('source_size') == stat.st_size:
+        return True
+    return header.get('source_sha256') == file_sha256(source_path)
+
+
+def model_path(xlsx_path):
+    """Path of the model file converted from `xlsx_path`."""
+    return os.path.splitext(xlsx_path)[0] + MODEL_SUFFIX
+
+
+def convert(xlsx_path, check=True):
+    """Converts one xlsx to a model file next to it; with `check`, verifies the round trip."""
+    features, states, weights = read_influence_xlsx(xlsx_path)
+    path = model_path(xlsx_path)
+    write_model_file(path, features, states, weights, source=xlsx_path)
+    if check:
+        verify(xlsx_path, (features, states, weights))
+    return path
+
+
+def verify(xlsx_path, parsed=None):
+    """Raises ValueError unless the model file of `xlsx_path` holds exactly its events and weights."""
+    features, states, weights = parsed if parsed is not None else read_influence_xlsx(xlsx_path)
+    path = model_path(xlsx_path)
+    m_features, m_states, m_weights, header = read_model_file(path)
+    if m_features != features or m_states != states:
+        raise ValueError(f"{path}: events differ from {xlsx_path}")
+    if not np.array_equal(m_weights, weights):
+        raise ValueError(f"{path}: weights differ from {xlsx_path}")
+    if not source_matches(header, xlsx_path):
+        raise ValueError(f"{path} was converted from another version of {xlsx_path}")
+
+
+def _data_offset(header_size):
+    """Start of the weight block: after the header, rounded up to 8 bytes."""
+    end = _PREAMBLE.size + header_size
+    return end + (-end) % _DTYPE.itemsize
+
+
+def file_sha256(path):
+    """Hex SHA-256 of a file's contents."""
+    with open(path, 'rb') as fh:
+        return hashlib.sha256(fh.read()).hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert influence score xlsx files to memory-mappable .via models.")
+    parser.add_argument('paths', nargs='+', help="xlsx files, or folders to convert every xlsx in")
+    parser.add_argument('--check', action='store_true',
+                        help="Only verify that the existing .via files match their xlsx (exit 1 if not)")
+    args = parser.parse_args()
+
+    xlsx_paths = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            xlsx_paths.extend(sorted(glob.glob(os.path.join(glob.escape(path), '*.xlsx'))))
+        else:
+            xlsx_paths.append(path)
+
+    failed = False
+    for xlsx_path in xlsx_paths:
+        try:
+            if args.check:
+                verify(xlsx_path)
+                print(f"{model_path(xlsx_path)}: OK")
+            else:
+                print(f"{xlsx_path} -> {convert(xlsx_path)}")
+        except (OSError, ValueError) as exc:
+            print(f"{xlsx_path}: {exc}", file=sys.stderr)
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,108 +1,1189 @@
-import pandas as pd
 import numpy as np
+import array
+import csv
 import os
-from via.engine import generate_graph_weights, initiate_bp_messages, run_belief_propagation
+import glob
+import re
+import threading
+import time
+import warnings
+from collections import OrderedDict
+from utils import legend as default_legend
+from via.engine import (BPTracer, generate_graph_weights, detect_topology, initiate_bp_messages, run_belief_propagation,
+                        run_inference, run_star_propagation_batch)
+from via.graph import FactorGraph
+from model_format import MODEL_SUFFIX, file_sha256, read_influence_xlsx, read_model_file, source_matches
+
+CACHE_DIRNAME = '.via_cache'
+
+# Optional per-feature population marginals in the results folder (columns: event, probability)
+POPULATION_FILENAME = 'PopulationMarginals.csv'
+
+# Loopy BP settings, used only when the graph has cycles
+BP_PRECISION = 1e-7
+BP_MAX_ITER = 1000
+
+# Memoized calculate_risk results per model (0 disables the cache)
+RISK_CACHE_SIZE = 4096
+
+# Weight ensembles: replicates, log-normal noise scale, replicates per pass and
+# largest replicate x patient block of risks held at once
+ENSEMBLE_SIZE = 200
+ENSEMBLE_SCALE = 0.1
+ENSEMBLE_CHUNK = 32
+ENSEMBLE_BLOCK = 1 << 22
 
 class AMDRiskModel:
-    def __init__(self, results_path, amd_cutoff=3):
+    def __init__(self, results_path, amd_cutoff=3, cache_size=RISK_CACHE_SIZE):
         self.results_path = results_path
         self.amd_cutoff = amd_cutoff
         self.model_params = None
+        self.weights = None
+        self.event_rows = {}
         self.graph_structure = None
+        self.factor_graph = None
+        self.topology = None
+        self.risk_table = None
+        self.population = {}
+        self._legend = None
+        self.risk_cache = RiskCache(cache_size)
         
-    def load_model(self, fixed_state=1, label_col='ASMULTIMODALORRES_E1_C18'):
-        """Loads trained weights from the results Excel file."""
+    def load_model(self, fixed_state=1, label_col='ASMULTIMODALORRES_E1_C18', cache_dir=None, legend=None,
+                   validate=False, population_data=None):
+        """
+        Loads trained weights from the results folder.
         
-        file_path = os.path.join(self.results_path, f"InfluenceScores_fixedSate{fixed_state}_AMD_cutoff{self.amd_cutoff}.xlsx")
-        data_csv = pd.read_excel(file_path)
-
-        dummy_header = data_csv['event'].values
+        The binary model file (.via, see `model_format`) is preferred: its weight
+        block is memory-mapped and loading needs neither pandas nor openpyxl.
+        If the Excel file changed after the conversion, a warning is issued and
+        the Excel file is used instead. Without a .via, the Excel file is parsed and cached as a binary .npz next to
+        the source (or in `cache_dir`), so later loads skip Excel parsing until
+        the file changes. Potential tables are then compiled against `legend` (default `utils.legend`).
+        With `validate`, the compiled risk table is checked against full BP
+        (see `validate_risk_table`).
         
-        # Extract weights
-        x0_0 = data_csv['0_x=0'].values
-        x1_0 = data_csv['0_x=1'].values
-        x0_1 = data_csv['1_x=0'].values
-        x1_1 = data_csv['1_x=1'].values
+        `population_data` gives the population marginals used as the prior of
+        unobserved features: {feature: {state ID or label: probability}}, or the
+        path of a CSV with 'event' ('feature:label') and 'probability' columns.
+        By default POPULATION_FILENAME in `results_path` is used if present;
+        features without marginals stay uniform.
+        """
+        if population_data is None:
+            default_path = os.path.join(self.results_path, POPULATION_FILENAME)
+            population_data = default_path if os.path.exists(default_path) else {}
+        if isinstance(population_data, str):
+            population_data = _read_population_marginals(population_data)
+        self.population = population_data
+        
+        file_path = os.path.join(self.results_path, f"InfluenceScores_fixedSate{fixed_state}_AMD_cutoff{self.amd_cutoff}")
+        model_file, xlsx_file = file_path + MODEL_SUFFIX, file_path + '.xlsx'
+        features = None
+        if os.path.exists(model_file):
+            features, states, weights, header = read_model_file(model_file)
+            if os.path.exists(xlsx_file) and not source_matches(header, xlsx_file):
+                warnings.warn(f"{xlsx_file} changed after {model_file} was converted; loading the xlsx "
+                              f"(run model_format.py to reconvert)", stacklevel=2)
+                features = None
+        if features is None:
+            features, states, weights = _read_influence_scores(xlsx_file, cache_dir)
 
-        self.dic_weights = {}
+        # weights columns: 0_x=0, 0_x=1, 1_x=0, 1_x=1
+        self.weights = weights
+        self.event_rows = {} # feature -> {state label: row of `weights`}
         self.node_states = {} # nsh in original code
-
-        for i, h in enumerate(dummy_header):
-            cut = h.find(':')
-            feature = h[0:cut]
-            value_range = h[cut+1:]
-            
-            if feature not in self.dic_weights:
-                self.node_states[feature] = 1
-                self.dic_weights[feature] = {}
-            else:
-                self.node_states[feature] += 1
-                
-            self.dic_weights[feature][value_range] = {0: [x0_0[i], x1_0[i]], 1: [x0_1[i], x1_1[i]]}
+        for row, (feature, value_range) in enumerate(zip(features, states)):
+            self.event_rows.setdefault(feature, {})[value_range] = row
+            self.node_states[feature] = self.node_states.get(feature, 0) + 1
 
         self.node_states[label_col] = 2
         
         # Generate Graph Structure
-        nV = len(self.dic_weights.keys()) + 1
+        nV = len(self.event_rows) + 1
         self.graph_structure = generate_graph_weights(nV)
+        N, Nf, t, q, vf, fv = self.graph_structure
+        self.topology = detect_topology(N, Nf, fv, vf)
         self.header_1 = list(self.node_states.keys())
 
-    def calculate_risk(self, patient_profile, legend):
+        self._compile(legend if legend is not None else default_legend)
+        if validate:
+            self.validate_risk_table()
+
+    def calculate_risk(self, patient_profile, legend=None, diagnostics=False, contributions=False):
         """
         Calculates risk for a specific patient profile.
         
         Args:
             patient_profile (dict): Dictionary of feature values (e.g., {'age': 1, 'smoker': 0})
-            population_data (dict): The full dataset to compute priors/marginals.
+            legend (dict): Mapping of integer states to string descriptions. Defaults
+                to the legend the model was compiled with.
+            diagnostics (bool): Also return a RiskDiagnostics with the inference path,
+                iterations, final error, convergence flag and timing.
+            contributions (bool): Also return a RiskContributions with each feature's
+                log-odds contribution, read from the same inference's messages.
+        
+        Returns:
+            float, or (risk, contributions, diagnostics) with the requested extras
+            in that order.
+        
+        Scores are memoized in `risk_cache`, keyed by cutoff and evidence, until the
+        model is reloaded or compiled against another legend. Diagnostics and
+        contributions calls always run inference.
+        """
+        self._ensure_compiled(legend)
+        if not diagnostics and not contributions:
+            key = (self.amd_cutoff, self._evidence_key(patient_profile))
+            risk_score = self.risk_cache.get(key)
+            if risk_score is None:
+                risk_score = self._score_evidence(key[1])
+                self.risk_cache.put(key, risk_score)
+            return risk_score
+        return self._calculate_risk(patient_profile, diagnostics=diagnostics, contributions=contributions)
+
+    def _calculate_risk(self, patient_profile, diagnostics=False, contributions=False):
+        start = time.perf_counter() if diagnostics else None
+        breakdown = None
+
+        if self.topology == 'star':
+            # Closed form on precompiled tables: only the evidence rows depend on the patient
+            evidence = []
+            for k, feature_name in enumerate(self.header_1):
+                idx = self._evidence_row(k, patient_profile.get(feature_name))
+                evidence.append(self._evidence_rows[feature_name][idx:idx + 1])
+            marginal = run_star_propagation_batch(evidence[:-1], self._weight_tables, evidence[-1])
+            risk_score = float(marginal[0, 1]) # Probability of State 1 (Disease)
+            if contributions:
+                log_odds, delta = self.risk_table.contributions([self._evidence_key(patient_profile)])
+                breakdown = RiskContributions(self.header_1[:-1], log_odds[0, :-1], delta[0, :-1], risk_score)
+            return _with_extras(risk_score, breakdown,
+                                RiskDiagnostics('star', 1, 0.0, True, time.perf_counter() - start) if diagnostics else None)
+
+        N, Nf, t, q, vf, fv = self.graph_structure
+        
+        # Potential Matrix (vm): shared weight tables plus patient specific evidence
+        vm = dict(self._vm_template)
+        for f, feature_name in self._evidence_factors:
+            idx = self._evidence_row(self._node_index[feature_name], patient_profile.get(feature_name))
+            vm[f] = self._evidence_rows[feature_name][idx][:, None]
+
+        # Loopy BP only runs if the structure has cycles
+        tracer = BPTracer() if diagnostics and self.topology == 'loopy' else None
+        result = run_inference(N, Nf, fv, vf, vm, self._nv, precision=BP_PRECISION, max_iter=BP_MAX_ITER,
+                               topology=self.topology, tracer=tracer, graph=self.factor_graph,
+                               return_underflow=diagnostics)
+        _, nuaj, marginals, n_iter, error = result[:5]
+
+        # Extract Risk Score
+        # Assumes the last node is the Disease Node
+        disease_node_idx = N 
+        risk_score = float(marginals[disease_node_idx][1, 0]) # Probability of State 1 (Disease)
+        
+        if contributions:
+            log_odds, delta = self._message_contributions(nuaj)
+            breakdown = RiskContributions(self.header_1[:-1], log_odds, delta, risk_score)
+        return _with_extras(risk_score, breakdown,
+                            RiskDiagnostics(self.topology, n_iter, error, error <= BP_PRECISION,
+                                            time.perf_counter() - start, tracer, underflow=result[5])
+                            if diagnostics else None)
+
+    def _message_contributions(self, nuaj):
+        """
+        Log-odds of each feature's converged message into the Disease node, and
+        its change when the feature's evidence is replaced by the "unobserved" row.
+        
+        The reference keeps every other incoming message of the feature fixed, so
+        it is exact on trees and first order on loopy graphs.
+        """
+        N = len(self.header_1)
+        log_odds = np.empty(N - 1)
+        reference = np.empty(N - 1)
+        for k, (f, u) in enumerate(self._target_factors):
+            v = k + 1
+            log_odds[k] = _log_odds(np.ravel(nuaj[f][N]))
+            others = np.ones(self._nv[v])
+            for g in self.factor_graph.factors_of(v):
+                if g not in (f, u):
+                    others *= np.ravel(nuaj[g][v])
+            unobserved = self._evidence_rows[self.header_1[k]][-1]
+            reference[k] = _log_odds((unobserved * others) @ self._weight_tables[k])
+        with np.errstate(invalid='ignore'):
+            return log_odds, log_odds - reference
+
+    def calculate_risk_batch(self, profiles, legend=None, contributions=False):
+        """
+        Calculates risk for many patient profiles in one vectorized pass.
+        
+        Args:
+            profiles (list | pd.DataFrame): Profile dicts, or a DataFrame with one
+                column of state IDs per feature. Missing features, -1 and NaN are
+                treated as unobserved.
             legend (dict): Mapping of integer states to string descriptions.
+            contributions (bool): Also return a RiskContributions with
+                (n_patients, n_features) log-odds and delta arrays.
+        
+        Returns:
+            np.ndarray: Risk score of each profile, in input order, or
+            (risks, contributions).
+        """
+        self._ensure_compiled(legend)
+        rows = self._evidence_matrix(profiles)
+        n_patients = len(rows)
+
+        if self.risk_table is not None:
+            risks = self.risk_table.score_rows(rows)
+            if not contributions:
+                return risks
+            log_odds, delta = self.risk_table.contributions(rows)
+            return risks, RiskContributions(self.header_1[:-1], log_odds[:, :-1], delta[:, :-1], risks)
+
+        # Without a table each distinct evidence pattern (observed states and
+        # missing-data pattern) runs inference once
+        patterns, inverse = np.unique(rows, axis=0, return_inverse=True)
+        inverse = np.ravel(inverse)
+        if not contributions:
+            risks = np.array([self._score_evidence(tuple(row)) for row in patterns.tolist()])
+            return risks[inverse] if n_patients else np.zeros(0)
+
+        n_features = len(self.header_1) - 1
+        risks = np.zeros(len(patterns))
+        log_odds = np.zeros((len(patterns), n_features))
+        delta = np.zeros((len(patterns), n_features))
+        for n, row in enumerate(patterns.tolist()):
+            profile = {f: _state_id(r, self.node_states[f]) for f, r in zip(self.header_1, row)}
+            risks[n], breakdown = self._calculate_risk(profile, contributions=True)
+            log_odds[n], delta[n] = breakdown.log_odds, breakdown.delta
+        risks = risks[inverse]
+        return risks, RiskContributions(self.header_1[:-1], log_odds[inverse], delta[inverse], risks)
+
+    def risk_curve(self, patient_profile, variable='age_E1', legend=None):
+        """
+        Risk Score of a profile for every state of `variable` (by default each
+        prediction horizon of age_E1), the rest of the evidence held fixed.
+        
+        Returns:
+            np.ndarray: (num_states,) Risk Scores, indexed by state ID.
+        """
+        return self.risk_curve_batch([patient_profile], variable, legend)[0]
+
+    def risk_curve_batch(self, profiles, variable='age_E1', legend=None):
+        """
+        Risk curves of many profiles over every state of `variable`.
+        
+        With a risk table, the other nodes' log-odds are summed once per patient
+        and only the swept node's rows vary. Otherwise inference runs once per
+        state and distinct pattern of the other evidence.
+        
+        Returns:
+            np.ndarray: (n_patients, num_states) Risk Scores, in input order.
+        """
+        self._ensure_compiled(legend)
+        k = self._node_index.get(variable)
+        if k is None or k == len(self.header_1) - 1:
+            raise ValueError(f"{variable!r} is not a feature of the model")
+        num_states = self.node_states[variable]
+        rows = self._evidence_matrix(profiles)
+
+        if self.risk_table is not None:
+            return self.risk_table.sweep_rows(rows, k, num_states)
+
+        rows[:, k] = 0 # Swept anyway: patterns differ only in the other evidence
+        patterns, inverse = np.unique(rows, axis=0, return_inverse=True)
+        curves = np.empty((len(patterns), num_states))
+        for n, row in enumerate(patterns.tolist()):
+            for state in range(num_states):
+                row[k] = state
+                curves[n, state] = self._score_evidence(tuple(row))
+        return curves[np.ravel(inverse)]
+
+    def sample_weight_ensemble(self, n_replicates=ENSEMBLE_SIZE, scale=ENSEMBLE_SCALE, seed=0):
         """
+        Perturbed replicates of the influence scores: each weight times
+        exp(scale * N(0, 1)), drawn from a generator seeded with `seed`, so
+        zeros stay zero and weights stay positive.
+        
+        Returns:
+            np.ndarray: (n_replicates, n_events, 4) weights, columns ordered as model_format.WEIGHT_COLUMNS.
+        """
+        rng = np.random.default_rng(seed)
+        return self.weights * np.exp(scale * rng.standard_normal((n_replicates,) + self.weights.shape))
+
+    def calculate_risk_ensemble(self, profiles, ensemble=None, n_replicates=ENSEMBLE_SIZE, scale=ENSEMBLE_SCALE,
+                                seed=0, quantiles=(0.025, 0.5, 0.975), chunk_size=ENSEMBLE_CHUNK, legend=None):
+        """
+        Risk Score uncertainty under an ensemble of influence scores.
+        
+        Args:
+            profiles (list | pd.DataFrame): As for `calculate_risk_batch`.
+            ensemble (np.ndarray): (n_replicates, n_events, 4) weight replicates, e.g.
+                bootstrap refits. Default: `sample_weight_ensemble(n_replicates, scale, seed)`.
+            quantiles (tuple): Quantile levels to report.
+            chunk_size (int): Replicates scored per pass. Patients are processed in
+                blocks of at most ENSEMBLE_BLOCK risks, so memory stays bounded.
+        
+        Returns:
+            RiskEnsemble: Mean, standard deviation and quantiles of each patient's risk.
+        """
+        self._ensure_compiled(legend)
+        if self.risk_table is None:
+            raise ValueError(f"No risk table: the {self.topology} topology needs BP for every profile")
+        if ensemble is None:
+            ensemble = self.sample_weight_ensemble(n_replicates, scale, seed)
+        ensemble = np.asarray(ensemble, dtype=np.float64)
+        if ensemble.ndim != 3 or ensemble.shape[1:] != self.weights.shape:
+            raise ValueError(f"Expected (n_replicates, {len(self.weights)}, 4) weights, got {ensemble.shape}")
+
+        n_replicates = len(ensemble)
+        # One log-odds row per replicate; small next to the risks, so built once
+        log_odds = np.concatenate([self._ensemble_log_odds(ensemble[c:c + chunk_size])
+                                   for c in range(0, n_replicates, chunk_size)])
+        idx = self._evidence_matrix(profiles) + self.risk_table.offsets
+        n_patients = len(idx)
+
+        mean = np.empty(n_patients)
+        std = np.empty(n_patients)
+        levels = np.asarray(quantiles, dtype=float)
+        q = np.empty((n_patients, len(levels)))
+        block = max(1, ENSEMBLE_BLOCK // max(n_replicates, 1))
+        for start in range(0, n_patients, block):
+            rows = idx[start:start + block]
+            risks = np.empty((n_replicates, len(rows)))
+            for c in range(0, n_replicates, chunk_size):
+                total = np.zeros((min(chunk_size, n_replicates - c), len(rows)))
+                for k in range(rows.shape[1]):
+                    total += log_odds[c:c + chunk_size, rows[:, k]]
+                risks[c:c + chunk_size] = _risk_from_log_odds(total)
+            mean[start:start + block] = risks.mean(axis=0)
+            std[start:start + block] = risks.std(axis=0)
+            q[start:start + block] = np.quantile(risks, levels, axis=0).T
+        return RiskEnsemble(mean, std, levels, q, n_replicates)
+
+    def validate_risk_table(self, n_profiles=256, seed=0, tol=1e-9):
+        """
+        Checks the compiled risk table against `run_belief_propagation` on random
+        profiles (about 20% of values unobserved, plus the all-unobserved profile).
+        
+        Returns:
+            float: Largest absolute Risk Score difference.
+        
+        Raises:
+            ValueError: If the model has no risk table or a difference exceeds `tol`.
+        """
+        if self.risk_table is None:
+            raise ValueError(f"No risk table: the {self.topology} topology needs BP for every profile")
+
+        rng = np.random.default_rng(seed)
+        num_states = np.array([self.node_states[f] for f in self.header_1])
+        rows = rng.integers(0, num_states, size=(n_profiles, len(num_states)))
+        rows = np.where(rng.random(rows.shape) < 0.2, num_states, rows)
+        rows[0] = num_states
+        table_risk = self.risk_table.score_rows(rows)
+
         N, Nf, t, q, vf, fv = self.graph_structure
+        max_diff = 0.0
+        for row, expected in zip(rows, table_risk):
+            vm = self._vm_for_rows(row)
+            nuja0, nuaj0 = initiate_bp_messages(N, Nf, vf, fv, vm, self._nv)
+            _, _, marginals, _, _ = run_belief_propagation(N, Nf, fv, vf, nuja0, nuaj0, BP_PRECISION, BP_MAX_ITER,
+                                                           vm, self._nv)
+            max_diff = max(max_diff, abs(float(marginals[N][1, 0]) - expected))
+
+        if max_diff > tol:
+            raise ValueError(f"Risk table deviates from BP by {max_diff:.3g} (tolerance {tol:.3g})")
+        return max_diff
+
+    def infer(self, patient_profile, legend=None):
+        """
+        Runs inference and keeps the messages into the Disease node so that
+        counterfactuals can be derived with `rescore`.
         
-        # Initialize Potential Matrix (vm)
-        vm = {}
+        Returns:
+            InferenceState: Baseline result; `.risk` is the Risk Score.
+        """
+        self._ensure_compiled(legend)
+        if self.topology != 'star':
+            return InferenceState(patient_profile, None, None, self.calculate_risk(patient_profile))
+
+        # One message per feature (evidence . weight column), plus the Disease evidence
+        messages = np.empty((len(self.header_1), 2))
+        for k, feature_name in enumerate(self.header_1):
+            messages[k] = self._target_message(k, patient_profile.get(feature_name))
+        return InferenceState(patient_profile, messages, np.prod(messages, axis=0))
+
+    def rescore(self, baseline, changes):
+        """
+        Re-scores a baseline after changing a few features (e.g. {'lh_phy_exercise_E1_C6': 1}).
+        
+        Only the messages of the changed features are recomputed: the Disease belief
+        has the old message divided out and the new one multiplied in.
         
+        Returns:
+            InferenceState: The counterfactual result, which can itself be re-scored.
+        """
+        profile = dict(baseline.profile)
+        profile.update(changes)
+        if baseline.messages is None:
+            return self.infer(profile)
+
+        messages = baseline.messages.copy()
+        belief = baseline.belief.copy()
+        divisible = True
+        for feature_name, value in changes.items():
+            k = self._node_index.get(feature_name)
+            if k is None:
+                continue
+            new = self._target_message(k, value)
+            if divisible and np.all(messages[k] != 0):
+                belief = belief / messages[k] * new
+            else:
+                divisible = False
+            messages[k] = new
+
+        # A zero message cannot be divided out; rebuild the product instead
+        if not divisible:
+            belief = np.prod(messages, axis=0)
+        return InferenceState(profile, messages, belief)
+
+    def sweep_interventions(self, patient_profile, variables, allowed_moves=None, top_k=None):
+        """
+        Scores every combination of states of `variables` and ranks them by Risk Score.
+        
+        Args:
+            patient_profile (dict): Baseline profile.
+            variables (list): Modifiable features (e.g. SIMULATION_VARIABLES in app.py).
+            allowed_moves (dict): Optional per-variable constraint: a list or array of
+                allowed state IDs, or 'improve' to keep only states that do not raise the
+                risk when changed alone. The current state is always allowed.
+            top_k (int): Return only the k lowest-risk scenarios, found without
+                materializing the full grid.
+        
+        Returns:
+            pd.DataFrame: One row per scenario with the state of each variable,
+            'n_changes', 'risk' and 'delta' versus the baseline, lowest risk first.
+        """
+        allowed_moves = allowed_moves or {}
+        baseline = self.infer(patient_profile)
+
+        # Candidate evidence rows per variable; the current row (possibly "unobserved") comes first
+        candidates = []
+        improve = []
+        for feature_name in variables:
+            rows = self._evidence_rows[feature_name]
+            num_states = rows.shape[1]
+            current = self._evidence_row(self._node_index[feature_name], patient_profile.get(feature_name))
+            allowed = allowed_moves.get(feature_name)
+            # A string is a rule, anything else a collection of states (possibly an array)
+            if isinstance(allowed, str) and allowed != 'improve':
+                raise ValueError(f"Unknown allowed move {allowed!r} for {feature_name}; expected 'improve' or states")
+            improve.append(isinstance(allowed, str))
+            if allowed is None or isinstance(allowed, str):
+                allowed = range(num_states)
+            cands = [current] + [s for s in allowed if 0 <= s < num_states and s != current]
+            candidates.append(np.array(cands, dtype=np.intp))
+
+        if baseline.messages is None:
+            return self._sweep_by_rescoring(baseline, variables, candidates, improve, top_k)
+
+        ks = [self._node_index[feature_name] for feature_name in variables]
+        rest = np.prod(np.delete(baseline.messages, ks, axis=0), axis=0)
+        tables = [self._evidence_rows[f][c] @ self._weight_tables[k] for f, c, k in zip(variables, candidates, ks)]
+        keys = [_logit_key(t) for t in tables]
+
+        for j in range(len(variables)):
+            if improve[j]:
+                keep = keys[j] <= keys[j][0]
+                candidates[j], tables[j], keys[j] = candidates[j][keep], tables[j][keep], keys[j][keep]
+
+        if top_k is None:
+            # Full grid in one broadcast: belief[s_1, ..., s_n, :]
+            belief = rest
+            for table in tables:
+                belief = belief[..., None, :] * table
+            choice = np.indices(belief.shape[:-1]).reshape(len(tables), -1).T
+            belief = belief.reshape(-1, 2)
+        else:
+            choice = np.array(_k_smallest_sums(keys, top_k), dtype=np.intp).reshape(-1, len(tables))
+            belief = np.tile(rest, (len(choice), 1))
+            for j, table in enumerate(tables):
+                belief = belief * table[choice[:, j]]
+
+        total = np.sum(belief, axis=1)
+        risk = np.divide(belief[:, 1], total, out=np.zeros(len(total)), where=total != 0)
+        return _scenario_table(variables, candidates, choice, risk, baseline.risk, self.node_states)
+
+    def _sweep_by_rescoring(self, baseline, variables, candidates, improve, top_k):
+        """Sweep fallback for non-star graphs: one `rescore` per scenario."""
+        from itertools import product
+        for j, feature_name in enumerate(variables):
+            if improve[j]:
+                # States that do not raise the risk when changed alone; the current one always stays
+                keep = [0] + [i for i, row in enumerate(candidates[j][1:], 1)
+                              if self.rescore(baseline, {feature_name: _state_id(row, self.node_states[feature_name])}).risk
+                              <= baseline.risk]
+                candidates[j] = candidates[j][keep]
+        choice = np.array(list(product(*[range(len(c)) for c in candidates])), dtype=np.intp).reshape(-1, len(variables))
+        risk = np.empty(len(choice))
+        for n, idx in enumerate(choice):
+            changes = {f: _state_id(c[i], self.node_states[f]) for f, c, i in zip(variables, candidates, idx)}
+            risk[n] = self.rescore(baseline, changes).risk
+        table = _scenario_table(variables, candidates, choice, risk, baseline.risk, self.node_states)
+        return table if top_k is None else table.head(top_k)
+
+    def _vm_for_rows(self, rows):
+        """Potential dict for one evidence pattern: shared weight tables plus evidence rows."""
+        vm = dict(self._vm_template)
+        for f, feature_name in self._evidence_factors:
+            vm[f] = self._evidence_rows[feature_name][rows[self._node_index[feature_name]]][:, None]
+        return vm
+
+    def _score_evidence(self, rows):
+        """Risk Score of one evidence pattern (one evidence row per node, as in `_evidence_key`)."""
+        if self.risk_table is not None:
+            return float(self.risk_table.score_rows([rows])[0])
+        N, Nf, t, q, vf, fv = self.graph_structure
+        _, _, marginals, _, _ = run_inference(N, Nf, fv, vf, self._vm_for_rows(rows), self._nv,
+                                              precision=BP_PRECISION, max_iter=BP_MAX_ITER, topology=self.topology,
+                                              graph=self.factor_graph)
+        return float(marginals[N][1, 0])
+
+    def _evidence_matrix(self, profiles):
+        """(n_patients, n_nodes) evidence rows of profile dicts or a DataFrame, target last."""
+        n_patients = len(profiles)
+        rows = np.empty((n_patients, len(self.header_1)), dtype=np.intp, order='F') # Filled column by column
+        for k, feature_name in enumerate(self.header_1):
+            ids = _state_ids(profiles, feature_name, n_patients)
+            rows[:, k] = _state_row(ids, self.node_states[feature_name])
+        return rows
+
+    def _evidence_key(self, patient_profile):
+        """Canonical evidence of a profile: one evidence row per node, so all "unobserved" spellings match."""
+        get = patient_profile.get
+        return tuple([rows.get(get(feature_name), unobserved) for feature_name, rows, unobserved in self._key_rows])
+
+    def _evidence_row(self, k, value):
+        """Evidence row of node k for one profile value, normalized as in `_evidence_key`."""
+        _, rows, unobserved = self._key_rows[k]
+        return rows.get(value, unobserved)
+
+    def _target_message(self, k, value):
+        """Message from node k into the Disease node for one evidence value."""
+        feature_name = self.header_1[k]
+        evidence = self._evidence_rows[feature_name][self._evidence_row(k, value)]
+        if k == len(self.header_1) - 1:
+            return evidence # The Disease node's own evidence
+        return evidence @ self._weight_tables[k]
+
+    def _compile(self, legend):
+        """Resolves legend strings to weight tables once, so scoring only selects evidence."""
+        N, Nf, t, q, vf, fv = self.graph_structure
+
+        self._weight_tables = [self._weight_table(feature_name, legend) for feature_name in self.header_1[:-1]]
+
+        # Row s clamps state s; the extra last row is "unobserved": the population
+        # prior of the feature, or all ones (uniform) without one
+        self._evidence_rows = {}
+        for feature_name, num_states in self.node_states.items():
+            if feature_name == self.header_1[-1]:
+                prior = np.ones(num_states) # An unobserved Disease node is what we infer
+            else:
+                prior = self._population_prior(feature_name, num_states, legend)
+            self._evidence_rows[feature_name] = np.vstack([np.eye(num_states), prior[None, :]])
+
+        self._vm_template = {}
+        self._evidence_factors = []
         for f in range(1, Nf + 1):
             v = fv[f][0]
-            feature_name = self.header_1[v-1]
-            
-            # Check if this is a weight function node (connecting factor to Disease)
-            is_weight_node = (f > (len(self.header_1)-1)) and (f < (len(self.header_1)-1)*2 + 1)
-            
-            if is_weight_node:
-                # Compute joint occurrences from population data
-                # (Logic simplified for brevity - assumes population_data is processed)
-                num_states = self.node_states[feature_name]
-                vm[f] = np.zeros((num_states, 2))
-                
-                # Apply weights loaded from model
-                # Note: This logic requires matching the specific 'legend' string to the weight keys
-                for state_idx in range(num_states):
-                    state_str = legend[feature_name][state_idx]
-                    if state_str in self.dic_weights[feature_name]:
-                        # Example: Loading weight for Disease=1
-                        vm[f][state_idx, 1] = self.dic_weights[feature_name][state_str][1][1] 
-                        # Disease=0
-                        vm[f][state_idx, 0] = self.dic_weights[feature_name][state_str][0][1] 
+            if len(fv[f]) == 2:
+                # Weight function node connecting feature v to the Disease node
+                self._vm_template[f] = self._weight_tables[v - 1]
+            else:
+                self._evidence_factors.append((f, self.header_1[v - 1]))
+
+        # (feature-Disease factor, evidence factor) of each feature, in node order
+        unary = {fv[f][0]: f for f in range(1, Nf + 1) if len(fv[f]) == 1}
+        self._target_factors = [None] * (N - 1)
+        for f in range(1, Nf + 1):
+            if len(fv[f]) == 2 and fv[f][1] == N:
+                self._target_factors[fv[f][0] - 1] = (f, unary.get(fv[f][0]))
+
+        self._nv = {i: self.node_states[self.header_1[i-1]] for i in range(1, N+1)}
+        self.factor_graph = FactorGraph.from_dicts(N, Nf, fv, self._nv)
+        self._node_index = {feature_name: k for k, feature_name in enumerate(self.header_1)}
+        # Valid state ID -> evidence row; anything else is the "unobserved" row
+        self._key_rows = [(feature_name, {s: s for s in range(num_states)}, num_states)
+                          for feature_name, num_states in ((f, self.node_states[f]) for f in self.header_1)]
+        self._legend = legend
+
+        self.risk_table = None
+        if self.topology == 'star':
+            # Each node's message into the Disease node, for every evidence row
+            log_messages = [_log(self._evidence_rows[f] @ w) for f, w in zip(self.header_1, self._weight_tables)]
+            log_messages.append(_log(self._evidence_rows[self.header_1[-1]]))
+            self.risk_table = RiskTable(self.header_1, log_messages)
+        self.risk_cache.clear() # Memoized scores belong to the previous weights
+
+    def _ensure_compiled(self, legend):
+        if legend is not None and legend is not self._legend:
+            self._compile(legend)
+
+    def _population_prior(self, feature_name, num_states, legend):
+        """Normalized population marginal of a feature, keyed by state ID or legend label; ones if unknown."""
+        marginals = self.population.get(feature_name)
+        if not marginals:
+            return np.ones(num_states)
+        labels = legend.get(feature_name, {})
+        prior = np.array([marginals.get(s, marginals.get(labels.get(s), 0.0)) for s in range(num_states)], dtype=float)
+        total = prior.sum()
+        return prior / total if total > 0 else np.ones(num_states)
+
+    def _weight_table(self, feature_name, legend, weights=None):
+        """
+        (num_states, 2) potential linking a feature to the disease node, from the
+        loaded weights or a (..., n_events, 4) `weights` stack ((..., num_states, 2) then).
+        """
+        weights = self.weights if weights is None else weights
+        num_states = self.node_states[feature_name]
+        table = np.zeros(weights.shape[:-2] + (num_states, 2))
+        
+        # Note: This logic requires matching the specific 'legend' string to the weight keys
+        for state_idx in range(num_states):
+            row = self.event_rows[feature_name].get(legend[feature_name][state_idx])
+            if row is not None:
+                # Disease=1
+                table[..., state_idx, 1] = weights[..., row, 3]
+                # Disease=0
+                table[..., state_idx, 0] = weights[..., row, 1]
+        return table
 
+    def _ensemble_log_odds(self, ensemble):
+        """(n_replicates, total rows) Disease log-odds table, numbered as in `risk_table`, per weight replicate."""
+        tables = []
+        for feature_name in self.header_1:
+            evidence = self._evidence_rows[feature_name]
+            if feature_name == self.header_1[-1]:
+                messages = np.broadcast_to(evidence, (len(ensemble),) + evidence.shape) # Disease evidence
             else:
-                # Leaf node: Set patient specific evidence
-                num_states = self.node_states[feature_name]
-                vm[f] = np.zeros((num_states, 1))
-                
-                if feature_name in patient_profile:
-                    fixed_val = patient_profile[feature_name]
-                    vm[f][fixed_val] = 1.0 # Clamp state
-                else:
-                    vm[f] = np.ones((num_states, 1)) # Unobserved
-
-        # Run Inference
-        nv_dict = {i: self.node_states[self.header_1[i-1]] for i in range(1, N+1)}
-        nuja0, nuaj0 = initiate_bp_messages(N, Nf, vf, fv, vm, nv_dict)
-        _, _, marginals, _, _ = run_belief_propagation(N, Nf, fv, vf, nuja0, nuaj0, 1e-7, 1000, vm, nv_dict)
+                messages = evidence @ self._weight_table(feature_name, self._legend, ensemble)
+            with np.errstate(invalid='ignore'):
+                tables.append(_log(messages[..., 1]) - _log(messages[..., 0]))
+        return np.concatenate(tables, axis=1)
 
-        # Extract Risk Score
-        # Assumes the last node is the Disease Node
-        disease_node_idx = N 
-        risk_score = marginals[disease_node_idx][1] # Probability of State 1 (Disease)
+    @property
+    def dic_weights(self):
+        """Weights as nested dicts, dic_weights[feature][state label][disease] = [w(x=0), w(x=1)]."""
+        return {feature: {label: {0: self.weights[row, 0:2].tolist(), 1: self.weights[row, 2:4].tolist()}
+                          for label, row in rows.items()}
+                for feature, rows in self.event_rows.items()}
+
+
+class RiskTable:
+    """
+    Log contributions of every node state to the Disease belief of a star model.
+
+    The Disease belief is a product of one message per node, so its logarithm
+    is a sum of table rows and scoring needs no BP at all. Node k owns rows
+    offsets[k] .. offsets[k] + num_states: one per state and a last one for
+    "unobserved" (the row numbering of `_state_row`).
+    """
+
+    def __init__(self, features, log_messages):
+        self.features = list(features)
+        self.offsets = np.cumsum([0] + [len(m) for m in log_messages[:-1]])
+        # One contiguous column per Disease state: 1-D gathers are much faster than row gathers
+        self.log_belief = np.ascontiguousarray(np.vstack(log_messages).T) # (2, total rows)
+        with np.errstate(invalid='ignore'):
+            self.log_odds = self.log_belief[1] - self.log_belief[0]
+        self.reference_rows = np.cumsum([len(m) for m in log_messages]) - 1 # Each node's "unobserved" row
+
+    def score_rows(self, rows):
+        """Risk Scores for an (n_patients, n_nodes) array of evidence rows, in one gather and sum."""
+        idx = np.asarray(rows) + self.offsets
+        with np.errstate(invalid='ignore'):
+            log_odds = self.log_belief[1][idx].sum(axis=1) - self.log_belief[0][idx].sum(axis=1)
+        return _risk_from_log_odds(log_odds)
+
+    def sweep_rows(self, rows, k, num_states):
+        """(n_patients, num_states) Risk Scores with node k set to each of its states in turn."""
+        idx = np.delete(np.asarray(rows) + self.offsets, k, axis=1)
+        with np.errstate(invalid='ignore'):
+            log_odds = self.log_odds[idx].sum(axis=1)[:, None] + self.log_odds[self.offsets[k]:self.offsets[k] + num_states]
+        return _risk_from_log_odds(log_odds)
+
+    def contributions(self, rows):
+        """
+        Per-node log-odds of Disease for (n_patients, n_nodes) evidence rows, and
+        their change from each node's "unobserved" row. Rows sum to the logit of
+        the Risk Score; NaN marks a zero message.
+        """
+        idx = np.asarray(rows) + self.offsets
+        log_odds = self.log_odds[idx]
+        with np.errstate(invalid='ignore'):
+            return log_odds, log_odds - self.log_odds[self.reference_rows]
+
+
+class RiskCache:
+    """Thread-safe LRU map from (cutoff, evidence key) to Risk Score, with hit/miss counters."""
+
+    def __init__(self, maxsize=RISK_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Cached score for `key` (now most recently used), or None."""
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        """Stores `value`, evicting the least recently used entries beyond maxsize."""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def resize(self, maxsize):
+        """Changes the capacity, evicting least recently used entries if it shrinks."""
+        with self._lock:
+            self.maxsize = maxsize
+            while len(self._data) > max(maxsize, 0):
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """Drops every entry and resets the counters."""
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data), 'maxsize': self.maxsize}
+
+    def __len__(self):
+        return len(self._data)
+
+
+class InferenceState:
+    """Result of `AMDRiskModel.infer`: the profile, Disease-node messages and belief."""
+
+    def __init__(self, profile, messages, belief, risk=None):
+        self.profile = dict(profile)
+        self.messages = messages # (n_nodes, 2), Disease evidence in the last row
+        self.belief = belief     # Unnormalized Disease belief
+        self._risk = risk
+
+    @property
+    def risk(self):
+        """Probability of State 1 (Disease)."""
+        if self._risk is None:
+            total = np.sum(self.belief)
+            self._risk = float(self.belief[1] / total) if total != 0 else 0.0
+        return self._risk
+
+
+class RiskDiagnostics:
+    """How a Risk Score was computed: inference path, convergence and wall time."""
+
+    def __init__(self, method, n_iter, error, converged, elapsed_s, trace=None, underflow=False):
+        self.method = method       # 'star', 'tree' or 'loopy'
+        self.n_iter = n_iter
+        self.error = error
+        self.converged = converged # False when loopy BP stopped at BP_MAX_ITER
+        self.elapsed_s = elapsed_s
+        self.trace = trace         # BPTracer with per-iteration records (loopy only)
+        self.underflow = underflow # True when a message product underflowed: the score is not reliable
+
+    def __repr__(self):
+        return (f"RiskDiagnostics(method={self.method!r}, n_iter={self.n_iter}, error={self.error:.3g}, "
+                f"converged={self.converged}, underflow={self.underflow}, elapsed_s={self.elapsed_s:.3g})")
+
+
+class RiskContributions:
+    """
+    Why a Risk Score is what it is: each feature's share of the Disease log-odds.
+
+    `log_odds` is the log-odds of the feature's message into the Disease node; the
+    log-odds sum to logit(risk). `delta` is the change from the feature being
+    unknown (its population prior), the others held fixed: positive values
+    raise the risk. Arrays are (n_features,) for one profile and
+    (n_patients, n_features) for a batch.
+    """
+
+    def __init__(self, features, log_odds, delta, risk):
+        self.features = list(features)
+        self.log_odds = log_odds
+        self.delta = delta
+        self.risk = risk
+
+    def ranked(self, index=None):
+        """(feature, log_odds, delta) tuples, largest |delta| first; `index` picks a patient of a batch."""
+        log_odds = self.log_odds if index is None else self.log_odds[index]
+        delta = self.delta if index is None else self.delta[index]
+        order = np.argsort(-np.abs(np.nan_to_num(delta)), kind='stable')
+        return [(self.features[k], float(log_odds[k]), float(delta[k])) for k in order]
+
+    def to_dict(self, index=None):
+        """{feature: {'log_odds': ..., 'delta': ...}} in model order."""
+        log_odds = self.log_odds if index is None else self.log_odds[index]
+        delta = self.delta if index is None else self.delta[index]
+        return {f: {'log_odds': float(lo), 'delta': float(d)} for f, lo, d in zip(self.features, log_odds, delta)}
+
+    def __repr__(self):
+        return f"RiskContributions(n_features={len(self.features)}, shape={np.shape(self.log_odds)})"
+
+class RiskEnsemble:
+    """Per-patient Risk Score distribution over an ensemble of influence scores."""
+
+    def __init__(self, mean, std, levels, quantiles, n_replicates):
+        self.mean = mean           # (n_patients,)
+        self.std = std             # (n_patients,)
+        self.levels = levels       # Quantile levels, e.g. (0.025, 0.5, 0.975)
+        self.quantiles = quantiles # (n_patients, n_levels)
+        self.n_replicates = n_replicates
+
+    def interval(self, lower=0.025, upper=0.975):
+        """(n_patients, 2) bounds at two of the computed quantile levels."""
+        columns = [int(np.flatnonzero(np.isclose(self.levels, level))[0]) for level in (lower, upper)]
+        return self.quantiles[:, columns]
+
+    def __repr__(self):
+        return f"RiskEnsemble(n_patients={len(self.mean)}, n_replicates={self.n_replicates}, levels={self.levels.tolist()})"
+
+
+class MultiCutoffModel:
+    """
+    Every AMD cutoff of a results folder scored together: the full stage
+    transition profile of a patient in one vectorized pass.
+
+    The models must share features and states. Evidence rows are built once,
+    and the weight tables of all cutoffs are stacked along a leading cutoff
+    axis. For star models this gives one (n_cutoffs, total rows) table of
+    per-state Disease log-odds, with rows numbered as in `RiskTable`; other
+    topologies run inference once per cutoff and distinct evidence pattern.
+    """
+
+    def __init__(self, models):
+        self.models = sorted(models, key=lambda m: m.amd_cutoff)
+        if not self.models:
+            raise ValueError("No models to stack")
+        first = self.models[0]
+        for model in self.models[1:]:
+            if model.header_1 != first.header_1 or model.node_states != first.node_states:
+                raise ValueError(f"Cutoff {model.amd_cutoff} has other features or states than cutoff {first.amd_cutoff}")
+        self.cutoffs = [model.amd_cutoff for model in self.models]
+        self.header_1 = first.header_1
+        self.node_states = first.node_states
+        self.weight_tables = None # Per feature, (n_cutoffs, num_states, 2)
+        self.log_odds = None      # (n_cutoffs, total rows), star models only
+        self.offsets = None
+        self._legend = None
+        self._compile(first._legend)
+
+    def calculate_risk(self, patient_profile, legend=None):
+        """Risk Score of one profile at every cutoff, as an array ordered like `cutoffs`."""
+        self._ensure_compiled(legend)
+        return self._score_rows(np.array([self.models[0]._evidence_key(patient_profile)], dtype=np.intp))[0]
+
+    def calculate_risk_batch(self, profiles, legend=None):
+        """
+        Risk Scores of many profiles at every cutoff.
+        
+        Args:
+            profiles (list | pd.DataFrame): As for `AMDRiskModel.calculate_risk_batch`.
+            legend (dict): Mapping of integer states to string descriptions.
         
-        return float(risk_score)
\ No newline at end of file
+        Returns:
+            np.ndarray: (n_patients, n_cutoffs) Risk Scores, columns ordered like `cutoffs`.
+        """
+        self._ensure_compiled(legend)
+        return self._score_rows(self.models[0]._evidence_matrix(profiles))
+
+    def _score_rows(self, rows):
+        if self.log_odds is None:
+            patterns, inverse = np.unique(rows, axis=0, return_inverse=True)
+            risks = np.array([[model._score_evidence(tuple(row)) for model in self.models]
+                              for row in patterns.tolist()]).reshape(len(patterns), len(self.models))
+            return risks[np.ravel(inverse)]
+
+        idx = rows + self.offsets
+        with np.errstate(invalid='ignore'):
+            log_odds = np.stack([table[idx].sum(axis=1) for table in self.log_odds], axis=1)
+        return _risk_from_log_odds(log_odds)
+
+    def _compile(self, legend):
+        for model in self.models:
+            model._ensure_compiled(legend)
+        self.weight_tables = [np.stack([model._weight_tables[k] for model in self.models])
+                              for k in range(len(self.header_1) - 1)]
+        self._legend = legend
+
+        self.log_odds = None
+        if all(model.topology == 'star' for model in self.models):
+            # Each node's message into the Disease node for every evidence row and cutoff
+            tables = []
+            for k, feature_name in enumerate(self.header_1):
+                evidence = np.stack([model._evidence_rows[feature_name] for model in self.models])
+                messages = evidence @ self.weight_tables[k] if k < len(self.weight_tables) else evidence
+                with np.errstate(invalid='ignore'):
+                    tables.append(_log(messages[..., 1]) - _log(messages[..., 0]))
+            self.offsets = np.cumsum([0] + [t.shape[1] for t in tables[:-1]])
+            self.log_odds = np.ascontiguousarray(np.concatenate(tables, axis=1))
+
+    def _ensure_compiled(self, legend):
+        if legend is not None and legend is not self._legend:
+            self._compile(legend)
+
+
+class ModelRegistry:
+    """Loads one AMDRiskModel per AMD cutoff on first use and keeps it for reuse."""
+
+    def __init__(self, results_path, fixed_state=1, label_col='ASMULTIMODALORRES_E1_C18', cache_dir=None,
+                 cache_size=RISK_CACHE_SIZE, population_data=None):
+        self.results_path = results_path
+        self.fixed_state = fixed_state
+        self.label_col = label_col
+        self.cache_dir = cache_dir
+        self.cache_size = cache_size
+        self.population_data = population_data
+        self._models = {}
+        self._multi_cutoff = None
+        self._cutoffs = None
+        self._lock = threading.Lock()
+
+    def get(self, amd_cutoff):
+        """Returns the loaded model for `amd_cutoff`, loading it on first request."""
+        model = self._models.get(amd_cutoff)
+        if model is None:
+            with self._lock:
+                model = self._models.get(amd_cutoff)
+                if model is None:
+                    model = AMDRiskModel(self.results_path, amd_cutoff=amd_cutoff, cache_size=self.cache_size)
+                    model.load_model(fixed_state=self.fixed_state, label_col=self.label_col, cache_dir=self.cache_dir,
+                                     population_data=self.population_data)
+                    self._models[amd_cutoff] = model
+        return model
+
+    def multi_cutoff(self):
+        """MultiCutoffModel of every available cutoff, built on first request."""
+        if self._multi_cutoff is None:
+            models = [self.get(cutoff) for cutoff in self.available_cutoffs()]
+            with self._lock:
+                if self._multi_cutoff is None:
+                    self._multi_cutoff = MultiCutoffModel(models)
+        return self._multi_cutoff
+
+    def for_stage(self, stage):
+        """Returns the model that scores a patient at baseline `stage` (see `cutoff_for_stage`)."""
+        cutoff = self.cutoff_for_stage(stage)
+        if cutoff is None:
+            raise ValueError(f"No model for stage {stage!r}; available cutoffs: {self.available_cutoffs()}")
+        return self.get(cutoff)
+
+    def cutoff_for_stage(self, stage):
+        """
+        The AMD cutoff for a patient at baseline `stage`, or None if there is no model for it.
+
+        Stage 4 has no further transition, so stages above the highest cutoff
+        available use that cutoff.
+        """
+        available = self.available_cutoffs()
+        if not available:
+            return None
+        cutoff = min(int(stage), available[-1])
+        return cutoff if cutoff in available else None
+
+    def available_cutoffs(self):
+        """Cutoffs that have an influence score file (.via or .xlsx) in `results_path`, scanned once."""
+        if self._cutoffs is None:
+            pattern = os.path.join(glob.escape(self.results_path),
+                                   f"InfluenceScores_fixedSate{self.fixed_state}_AMD_cutoff*")
+            cutoffs = set()
+            for path in glob.glob(pattern):
+                match = re.search(r'_AMD_cutoff(\d+)(\.xlsx|' + re.escape(MODEL_SUFFIX) + ')$', path)
+                if match:
+                    cutoffs.add(int(match.group(1)))
+            self._cutoffs = sorted(cutoffs)
+        return list(self._cutoffs)
+
+def _read_influence_scores(file_path, cache_dir=None):
+    """
+    Returns (features, states, weights) for an influence score file.
+    
+    `weights` is a (n_events, 4) float64 block ordered as model_format.WEIGHT_COLUMNS. The
+    result is cached as .npz and reused while the source's mtime and size, or
+    failing that its SHA-256, still match.
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(file_path), CACHE_DIRNAME)
+    cache_path = os.path.join(cache_dir, os.path.basename(file_path) + '.npz')
+
+    stat = os.stat(file_path)
+    digest = None
+    if os.path.exists(cache_path):
+        try:
+            with np.load(cache_path, allow_pickle=False) as cached:
+                if int(cached['source_mtime_ns']) == stat.st_mtime_ns and int(cached['source_size']) == stat.st_size:
+                    return cached['features'].tolist(), cached['states'].tolist(), cached['weights']
+                # Touched but possibly unchanged (e.g. a fresh checkout)
+                digest = file_sha256(file_path)
+                if str(cached['source_sha256']) == digest:
+                    features, states, weights = cached['features'].tolist(), cached['states'].tolist(), cached['weights']
+                    _write_cache(cache_path, features, states, weights, stat, digest)
+                    return features, states, weights
+        except (OSError, KeyError, ValueError):
+            pass # Unreadable cache: rebuild it from the source
+
+    features, states, weights = read_influence_xlsx(file_path)
+    _write_cache(cache_path, features, states, weights, stat, digest or file_sha256(file_path))
+    return features, states, weights
+
+def _read_population_marginals(file_path):
+    """{feature: {label: probability}} from a CSV with 'event' ('feature:label') and 'probability' columns."""
+    population = {}
+    with open(file_path, newline='') as fh:
+        for row in csv.DictReader(fh):
+            feature, _, label = row['event'].partition(':')
+            population.setdefault(feature, {})[label] = float(row['probability'])
+    return population
+
+def _write_cache(cache_path, features, states, weights, stat, digest):
+    """Writes the cache atomically; a read-only results folder just skips caching."""
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path,
+                 features=np.array(features, dtype=str),
+                 states=np.array(states, dtype=str),
+                 weights=weights,
+                 source_mtime_ns=np.int64(stat.st_mtime_ns),
+                 source_size=np.int64(stat.st_size),
+                 source_sha256=np.array(digest))
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
+
+def _log(x):
+    with np.errstate(divide='ignore'):
+        return np.log(x)
+
+def _log_odds(message):
+    """log(message[1] / message[0]) of a 2-state message; NaN when both are zero."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return float(np.log(message[1]) - np.log(message[0]))
+
+def _risk_from_log_odds(log_odds):
+    """Risk Scores (sigmoid) of an array of Disease log-odds."""
+    with np.errstate(over='ignore', invalid='ignore'):
+        risk = 1.0 / (1.0 + np.exp(-log_odds))
+    return np.where(np.isnan(risk), 0.0, risk) # Zero belief scores as risk 0
+
+def _with_extras(risk_score, contributions, diagnostics):
+    """`risk_score`, or a tuple with whichever extras were requested."""
+    extras = tuple(x for x in (contributions, diagnostics) if x is not None)
+    return (risk_score,) + extras if extras else risk_score
+
+_MAX_STATE_ID = 2.0 ** 53 # Larger floats are not exact integers
+
+def _state_ids(profiles, feature_name, n_patients):
+    """
+    State IDs of one feature across profiles. Missing values, None, NaN and
+    non-integer or out-of-range numbers become -1, as in `calculate_risk`.
+    """
+    if hasattr(profiles, 'columns'):
+        if feature_name not in profiles.columns:
+            return np.full(n_patients, -1, dtype=np.intp)
+        values = profiles[feature_name].to_numpy()
+    else:
+        values = [p.get(feature_name) for p in profiles]
+    if isinstance(values, np.ndarray) and values.dtype.kind in 'biuf':
+        col = values.astype(float)
+    else:
+        try:
+            col = np.frombuffer(array.array('d', values)) # Numbers only: '1' is not state 1
+        except (TypeError, OverflowError):
+            col = None
+            if not any(issubclass(t, (str, bytes)) for t in set(map(type, values))):
+                try:
+                    col = np.array(values, dtype=float) # None becomes NaN
+                except (TypeError, ValueError, OverflowError):
+                    pass
+            if col is None: # One at a time, as `_evidence_key` sees them
+                col = np.array([_float_or_nan(v) for v in values], dtype=float)
+    valid = np.isfinite(col) & (col == np.floor(col)) & (np.abs(col) < _MAX_STATE_ID)
+    return np.where(valid, col, -1).astype(np.intp)
+
+def _float_or_nan(value):
+    if isinstance(value, (str, bytes)):
+        return np.nan # Not a state ID, even if it spells one
+    try:
+        return float(value)
+    except (TypeError, ValueError, OverflowError):
+        return np.nan
+
+def _state_row(ids, num_states):
+    """
+    Evidence row for each of an array of state IDs (see `_state_ids`): the ID
+    itself, or `num_states` when unobserved. Single values go through
+    `AMDRiskModel._evidence_row`.
+    """
+    return np.where((ids >= 0) & (ids < num_states), ids, num_states)
+
+def _state_id(row, num_states):
+    """Inverse of `_state_row`: the unobserved row maps back to -1."""
+    return -1 if row == num_states else int(row)
+
+def _logit_key(table):
+    """Per-state log-odds of Disease, clipped so that sums stay ordered and finite."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        key = np.log(table[:, 1]) - np.log(table[:, 0])
+    key = np.clip(key, -1e300, 1e300)
+    key[(table[:, 0] == 0) & (table[:, 1] == 0)] = -1e305 # Zero belief scores as risk 0
+    return key
+
+def _k_smallest_sums(keys, k):
+    """
+    Index tuples of the k smallest sums of one key per list, without the full grid.
+    
+    Each list is visited in sorted order; a tuple's successors only advance
+    positions at or after the last one advanced, so every tuple is pushed once.
+    """
+    import heapq
+    order = [np.argsort(key, kind='stable') for key in keys]
+    sorted_keys = [key[o] for key, o in zip(keys, order)]
+
+    start = (0,) * len(keys)
+    heap = [(float(sum(sk[0] for sk in sorted_keys)), start, 0)]
+    found = []
+    while heap and len(found) < k:
+        total, idx, last = heapq.heappop(heap)
+        found.append(tuple(int(o[i]) for o, i in zip(order, idx)))
+        for j in range(last, len(keys)):
+            if idx[j] + 1 < len(sorted_keys[j]):
+                nxt = idx[:j] + (idx[j] + 1,) + idx[j + 1:]
+                step = sorted_keys[j][idx[j] + 1] - sorted_keys[j][idx[j]]
+                heapq.heappush(heap, (total + float(step), nxt, j))
+    return found
+
+def _scenario_table(variables, candidates, choice, risk, baseline_risk, node_states):
+    """Ranked scenario DataFrame: lowest risk first, then fewest changes."""
+    import pandas as pd # Only scenario tables need pandas; scoring runs on NumPy alone
+    columns = {}
+    for j, feature_name in enumerate(variables):
+        state_ids = np.array([_state_id(r, node_states[feature_name]) for r in candidates[j]])
+        columns[feature_name] = state_ids[choice[:, j]]
+    n_changes = np.count_nonzero(choice, axis=1) # Candidate 0 is the current state
+    table = pd.DataFrame(columns)
+    table['n_changes'] = n_changes
+    table['risk'] = risk
+    table['delta'] = risk - baseline_risk
+    order = np.lexsort((n_changes, risk))
+    return table.iloc[order].reset_index(drop=True)
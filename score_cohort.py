@@ -0,0 +1,182 @@
+import argparse
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from risk_model import ModelRegistry
+from utils import legend
+
+
+# --- Configuration ---
+
+RESULTS_DIR = 'Influence Scores/'
+TARGET_LABEL = 'ASMULTIMODALORRES_E1_C18'
+STAGE_COLUMN = 'stage_before'
+
+# Per-process model registry, created once by the worker initializer
+_REGISTRY = None
+
+
+def _init_worker(results_dir):
+    global _REGISTRY
+    _REGISTRY = ModelRegistry(results_path=results_dir, label_col=TARGET_LABEL)
+
+
+def _to_state_ids(column, mapping):
+    """
+    Maps a column of state IDs or legend labels (e.g. 'Smoker', '[70,75[') to
+    state IDs. Anything that is not one of the legend's states (2.5, 1e30, 99)
+    becomes -1, as in `calculate_risk_batch`.
+    """
+    numeric = pd.to_numeric(column, errors='coerce')
+    label_to_id = {str(label): state_id for state_id, label in mapping.items()}
+    from_labels = column.astype(str).map(label_to_id)
+    ids = numeric.where(numeric.notna(), from_labels)
+    states = [state_id for state_id in mapping if state_id >= 0]
+    return ids.where(ids.isin(states), -1).astype(np.int64)
+
+
+def _score_chunk(chunk, cutoff, keep_columns):
+    """Scores one chunk; with cutoff='auto' each row uses its own baseline stage."""
+    features = [f for f in legend if f in chunk.columns]
+    profiles = pd.DataFrame({f: _to_state_ids(chunk[f], legend[f]) for f in features}, index=chunk.index)
+
+    if cutoff == 'auto':
+        if STAGE_COLUMN not in profiles.columns:
+            raise ValueError(f"--cutoff auto needs a '{STAGE_COLUMN}' column")
+        stages = profiles[STAGE_COLUMN]
+        # -1 (no model for the stage) keeps the column integer in every chunk
+        by_stage = {stage: _REGISTRY.cutoff_for_stage(stage) for stage in stages.unique()}
+        cutoffs = stages.map({stage: -1 if c is None else c for stage, c in by_stage.items()})
+    else:
+        cutoffs = pd.Series(int(cutoff), index=profiles.index)
+
+    risk = np.full(len(profiles), np.nan)
+    for c in cutoffs.unique():
+        if c < 0:
+            continue # Unknown baseline stage: no model to score with
+        rows = np.flatnonzero((cutoffs == c).to_numpy())
+        risk[rows] = _REGISTRY.get(int(c)).calculate_risk_batch(profiles.iloc[rows])
+
+    out = chunk[keep_columns].copy() if keep_columns else pd.DataFrame(index=chunk.index)
+    out['cutoff'] = cutoffs.to_numpy()
+    out['risk'] = risk
+    return out
+
+
+def _read_chunks(path, chunk_size):
+    """Yields DataFrames of at most chunk_size rows from a CSV or Parquet file."""
+    if path.endswith('.parquet'):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError as exc:
+            raise ImportError("Reading Parquet requires pyarrow (pip install pyarrow)") from exc
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_size)
+
+
+class _ChunkWriter:
+    """Appends scored chunks to a CSV or Parquet output file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._parquet = None
+        self._first = True
+
+    def write(self, frame):
+        if self.path.endswith('.parquet'):
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if self._parquet is None:
+                self._parquet = pq.ParquetWriter(self.path, table.schema)
+            self._parquet.write_table(table)
+        else:
+            frame.to_csv(self.path, mode='w' if self._first else 'a', header=self._first, index=False)
+        self._first = False
+
+    def close(self):
+        if self._parquet is not None:
+            self._parquet.close()
+
+
+def score_file(input_path, output_path, chunk_size=100000, workers=None, cutoff='auto',
+               keep_columns=None, results_dir=RESULTS_DIR):
+    """
+    Streams a patient file through the model and writes one risk per row.
+
+    At most 2 * workers chunks are in flight, so memory stays bounded by the
+    chunk size rather than the file size. Output rows keep the input order.
+    A fixed `cutoff` must have a model in `results_dir` (ValueError otherwise);
+    with 'auto', rows whose stage has no model get a NaN risk.
+    """
+    if cutoff != 'auto':
+        available = ModelRegistry(results_path=results_dir).available_cutoffs()
+        try:
+            cutoff = int(cutoff)
+        except ValueError:
+            raise ValueError(f"Cutoff must be 'auto' or one of {available}, got {cutoff!r}") from None
+        if cutoff not in available:
+            raise ValueError(f"No model for cutoff {cutoff} in {results_dir!r}; available: {available}")
+
+    workers = workers if workers is not None else os.cpu_count()
+    writer = _ChunkWriter(output_path)
+    n_rows = 0
+
+    def keep_for(chunk):
+        if keep_columns is not None:
+            return keep_columns
+        return [c for c in chunk.columns if c not in legend] # e.g. patient IDs
+
+    try:
+        if workers <= 1:
+            _init_worker(results_dir)
+            for chunk in _read_chunks(input_path, chunk_size):
+                scored = _score_chunk(chunk, cutoff, keep_for(chunk))
+                writer.write(scored)
+                n_rows += len(scored)
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(results_dir,)) as pool:
+                pending = deque()
+                for chunk in _read_chunks(input_path, chunk_size):
+                    pending.append(pool.submit(_score_chunk, chunk, cutoff, keep_for(chunk)))
+                    if len(pending) >= 2 * workers:
+                        scored = pending.popleft().result()
+                        writer.write(scored)
+                        n_rows += len(scored)
+                while pending:
+                    scored = pending.popleft().result()
+                    writer.write(scored)
+                    n_rows += len(scored)
+    finally:
+        writer.close()
+    return n_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a cohort file (CSV or Parquet) with the AMD VIA model.")
+    parser.add_argument('input', help="Patient file with one column per feature (state IDs or legend labels)")
+    parser.add_argument('output', help="Output file (.csv or .parquet)")
+    parser.add_argument('--chunk-size', type=int, default=100000, help="Rows per chunk (default: 100000)")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: CPU count; 1 = in-process)")
+    parser.add_argument('--cutoff', default='auto',
+                        help=f"AMD cutoff 0-3, or 'auto' to use each row's {STAGE_COLUMN} (default: auto)")
+    parser.add_argument('--keep', nargs='*', default=None,
+                        help="Input columns to copy to the output (default: all non-feature columns)")
+    parser.add_argument('--results-dir', default=RESULTS_DIR, help="Folder with the influence score files")
+    args = parser.parse_args()
+
+    try:
+        n_rows = score_file(args.input, args.output, chunk_size=args.chunk_size, workers=args.workers,
+                            cutoff=args.cutoff, keep_columns=args.keep, results_dir=args.results_dir)
+    except ValueError as exc:
+        parser.error(str(exc))
+    print(f"Scored {n_rows} patients -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+import argparse
+import asyncio
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from risk_model import ModelRegistry
+from utils import legend
+
+
+# --- Configuration ---
+
+RESULTS_DIR = 'Influence Scores/'
+TARGET_LABEL = 'ASMULTIMODALORRES_E1_C18'
+STAGE_COLUMN = 'stage_before'
+
+MAX_BATCH_SIZE = 64
+MAX_WAIT_MS = 2.0
+LATENCY_WINDOW = 10000 # Recent requests kept for the latency percentiles
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+class MicroBatcher:
+    """
+    Collects concurrent single-profile requests for one model into batches.
+
+    A batch is closed when it holds `max_batch_size` profiles or `max_wait_s`
+    after its first profile arrived, and is scored with one
+    `calculate_risk_batch` call on the scoring thread. Requests that arrive
+    while a batch is being scored queue up for the next one.
+    """
+
+    def __init__(self, model, executor, max_batch_size=MAX_BATCH_SIZE, max_wait_s=MAX_WAIT_MS / 1000, metrics=None):
+        self.model = model
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait_s = max_wait_s
+        self.metrics = metrics
+        self._queue = asyncio.Queue()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def score(self, profile):
+        """Risk Score of one profile, resolved when its batch has been scored."""
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((profile, future))
+        return await future
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait_s
+            while len(batch) < self.max_batch_size:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            profiles = [profile for profile, _ in batch]
+            try:
+                risks = await loop.run_in_executor(self.executor, self.model.calculate_risk_batch, profiles)
+            except Exception:
+                # Score one by one so that only the offending requests fail
+                await self._score_each(batch)
+                continue
+            if self.metrics is not None:
+                self.metrics.record_batch(len(batch))
+            for (_, future), risk in zip(batch, np.asarray(risks).tolist()):
+                if not future.done(): # The client may have gone away
+                    future.set_result(risk)
+
+    async def _score_each(self, batch):
+        loop = asyncio.get_running_loop()
+        for profile, future in batch:
+            try:
+                risk = await loop.run_in_executor(self.executor, self.model.calculate_risk_batch, [profile])
+            except Exception as exc:
+                if not future.done():
+                    future.set_exception(exc)
+                continue
+            if self.metrics is not None:
+                self.metrics.record_batch(1)
+            if not future.done():
+                future.set_result(float(risk[0]))
+
+
+class ServiceMetrics:
+    """Request, error and batch counters plus a window of recent request latencies."""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.started = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.batched_profiles = 0
+        self.latencies = deque(maxlen=window)
+
+    def record_request(self, elapsed_s, ok=True):
+        self.requests += 1
+        if not ok:
+            self.errors += 1
+        self.latencies.append(elapsed_s)
+
+    def record_batch(self, size):
+        self.batches += 1
+        self.batched_profiles += size
+
+    def snapshot(self):
+        latencies = np.array(self.latencies) * 1000
+        percentiles = {}
+        if len(latencies):
+            for q in (50, 95, 99):
+                percentiles[f'p{q}'] = float(np.percentile(latencies, q))
+            percentiles['max'] = float(latencies.max())
+        return {
+            'uptime_s': time.time() - self.started,
+            'requests': self.requests,
+            'errors': self.errors,
+            'batches': self.batches,
+            'mean_batch_size': self.batched_profiles / self.batches if self.batches else 0.0,
+            'latency_ms': percentiles,
+        }
+
+
+class ScoringService:
+    """
+    HTTP/1.1 JSON scoring service (asyncio, standard library only).
+
+    Endpoints:
+        POST /score    {"profile": {...}, "cutoff": 1} -> {"risk": ..., "cutoff": 1}
+                       Without "cutoff", the profile's stage_before is used
+                       (clipped to the highest cutoff available).
+        GET  /health   Status and available cutoffs.
+        GET  /metrics  Counters, mean batch size, latency percentiles and queue depths.
+
+    Profile values are state IDs or `legend` labels; missing features and -1 are
+    unobserved. Connections are kept alive unless the client asks to close.
+    """
+
+    def __init__(self, registry, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS):
+        self.registry = registry
+        self.max_batch_size = max_batch_size
+        self.max_wait_s = max_wait_ms / 1000
+        self.metrics = ServiceMetrics()
+        self.cutoffs = registry.available_cutoffs()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='scoring')
+        self._batchers = {}
+        self._server = None
+
+    async def start(self, host='127.0.0.1', port=8000):
+        """Loads every model and starts listening; returns the bound (host, port)."""
+        for cutoff in self.cutoffs:
+            batcher = MicroBatcher(self.registry.get(cutoff), self._executor, self.max_batch_size, self.max_wait_s,
+                                   self.metrics)
+            batcher.start()
+            self._batchers[cutoff] = batcher
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self):
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for batcher in self._batchers.values():
+            await batcher.stop()
+        self._executor.shutdown(wait=False)
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                parts = request_line.decode('latin-1').split()
+                if len(parts) != 3:
+                    status, payload, version = 400, {'error': "Malformed request line"}, 'HTTP/1.0'
+                else:
+                    method, path, version = parts
+                    status, payload = await self._route(method, path.split('?', 1)[0], body)
+
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                connection = '' if keep_alive else 'Connection: close\r\n'
+                data = json.dumps(payload).encode()
+                head = (f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                        f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n{connection}\r\n")
+                writer.write(head.encode('latin-1') + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass # Client went away or sent an unreadable request
+        finally:
+            writer.close()
+
+    async def _route(self, method, path, body):
+        if path == '/score':
+            if method != 'POST':
+                return 405, {'error': "Use POST"}
+            return await self._score(body)
+        if path in ('/health', '/metrics'):
+            if method != 'GET':
+                return 405, {'error': "Use GET"}
+            if path == '/health':
+                return 200, {'status': 'ok', 'cutoffs': self.cutoffs}
+            snapshot = self.metrics.snapshot()
+            snapshot['queue_depth'] = {str(c): b.queue_depth() for c, b in self._batchers.items()}
+            return 200, snapshot
+        return 404, {'error': f"Unknown path {path}"}
+
+    async def _score(self, body):
+        start = time.perf_counter()
+        try:
+            request = json.loads(body or b'{}')
+            profile = _parse_profile(request.get('profile'))
+            cutoff = request.get('cutoff')
+            if cutoff is None:
+                if profile.get(STAGE_COLUMN, -1) < 0:
+                    raise ValueError(f"Give a 'cutoff' or a '{STAGE_COLUMN}' in the profile")
+                cutoff = self.registry.cutoff_for_stage(profile[STAGE_COLUMN])
+                if cutoff is None:
+                    raise ValueError(f"No model for stage {profile[STAGE_COLUMN]}; available: {self.cutoffs}")
+            if cutoff not in self._batchers:
+                raise ValueError(f"No model for cutoff {cutoff!r}; available: {self.cutoffs}")
+        except (ValueError, TypeError, AttributeError) as exc: # json.JSONDecodeError is a ValueError
+            self.metrics.record_request(time.perf_counter() - start, ok=False)
+            return 400, {'error': str(exc)}
+
+        try:
+            risk = await self._batchers[cutoff].score(profile)
+        except Exception as exc:
+            self.metrics.record_request(time.perf_counter() - start, ok=False)
+            return 500, {'error': str(exc)}
+        self.metrics.record_request(time.perf_counter() - start)
+        return 200, {'risk': risk, 'cutoff': cutoff}
+
+
+def _parse_profile(profile):
+    """Maps a JSON profile of state IDs or legend labels to state IDs."""
+    if not isinstance(profile, dict):
+        raise ValueError("'profile' must be an object of feature -> state")
+    parsed = {}
+    for feature_name, value in profile.items():
+        mapping = legend.get(feature_name)
+        if mapping is None:
+            continue # Not a model feature (e.g. a patient ID)
+        if isinstance(value, str):
+            labels = {label: state_id for state_id, label in mapping.items()}
+            if value not in labels:
+                raise ValueError(f"Unknown label {value!r} for {feature_name}")
+            value = labels[value]
+        elif value is None:
+            value = -1
+        elif not isinstance(value, int) or isinstance(value, bool):
+            raise ValueError(f"State of {feature_name} must be an integer ID or a label")
+        elif value != -1 and value not in mapping:
+            raise ValueError(f"Unknown state ID {value!r} for {feature_name}; use -1 or null for unobserved")
+        parsed[feature_name] = value
+    return parsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve AMD VIA Risk Scores over HTTP with request micro-batching.")
+    parser.add_argument('--host', default='127.0.0.1', help="Interface to bind (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8000, help="Port to listen on (default: 8000)")
+    parser.add_argument('--max-batch-size', type=int, default=MAX_BATCH_SIZE,
+                        help=f"Most profiles scored together (default: {MAX_BATCH_SIZE})")
+    parser.add_argument('--max-wait-ms', type=float, default=MAX_WAIT_MS,
+                        help=f"Longest a request waits for its batch to fill (default: {MAX_WAIT_MS})")
+    parser.add_argument('--results-dir', default=RESULTS_DIR, help="Folder with the influence score files")
+    args = parser.parse_args()
+
+    async def run():
+        service = ScoringService(ModelRegistry(results_path=args.results_dir, label_col=TARGET_LABEL),
+                                 max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms)
+        host, port = await service.start(args.host, args.port)
+        print(f"Serving AMD Risk Scores on http://{host}:{port} (cutoffs {service.cutoffs})")
+        try:
+            await service.serve_forever()
+        finally:
+            await service.stop()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
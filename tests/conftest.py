@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+RESULTS_DIR = os.path.join(ROOT, 'Influence Scores')
+
+
+@pytest.fixture(scope='session')
+def results_dir():
+    return RESULTS_DIR
+
+
+@pytest.fixture(scope='session')
+def registry(results_dir):
+    from risk_model import ModelRegistry
+    return ModelRegistry(results_path=results_dir)
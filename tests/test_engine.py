@@ -0,0 +1,113 @@
+import numpy as np
+import pytest
+
+from main import patient_profile
+from via.engine import (detect_topology, generate_graph_weights, initiate_bp_messages, run_belief_propagation,
+                        run_inference)
+
+PRECISION = 1e-12
+
+
+def iterative(N, Nf, fv, vf, vm, nv):
+    nuja0, nuaj0 = initiate_bp_messages(N, Nf, vf, fv, vm, nv)
+    return run_belief_propagation(N, Nf, fv, vf, nuja0, nuaj0, PRECISION, 1000, vm, nv)
+
+
+def random_tree(seed):
+    """Six variables joined by two pairwise factors and one ternary factor, each with a unary factor."""
+    rng = np.random.default_rng(seed)
+    N = 6
+    nv = {1: 2, 2: 3, 3: 2, 4: 4, 5: 3, 6: 2}
+    fv = {1: [1, 2], 2: [2, 3, 4], 3: [4, 5], 4: [3, 6]}
+    for i in range(1, N + 1):
+        fv[len(fv) + 1] = [i]
+    Nf = len(fv)
+    vf = {i: [f for f in range(1, Nf + 1) if i in fv[f]] for i in range(1, N + 1)}
+    vm = {f: rng.uniform(0.1, 1.0, size=[nv[i] for i in variables]) for f, variables in fv.items()}
+    for f, variables in fv.items():
+        if len(variables) == 1:
+            vm[f] = vm[f][:, None]
+    return N, Nf, fv, vf, vm, nv
+
+
+def model_star(registry, cutoff):
+    model = registry.get(cutoff)
+    N, Nf, t, q, vf, fv = model.graph_structure
+    vm = model._vm_for_rows(model._evidence_key(patient_profile))
+    return N, Nf, fv, vf, vm, model._nv
+
+
+def normalized(message):
+    message = np.ravel(message)
+    total = message.sum()
+    return message / total if total else message
+
+
+def assert_same_result(exact, reference, N, fv):
+    _, nuaj, marginals, _, _ = exact
+    _, ref_nuaj, ref_marginals, _, ref_error = reference
+    assert ref_error <= PRECISION
+    for i in range(1, N + 1):
+        np.testing.assert_allclose(np.ravel(marginals[i]), np.ravel(ref_marginals[i]), rtol=1e-9, atol=1e-12)
+    for f, variables in fv.items():
+        for i in variables:
+            # Messages are defined up to scale; the engines normalize at different points
+            np.testing.assert_allclose(normalized(nuaj[f][i]), normalized(ref_nuaj[f][i]), rtol=1e-9, atol=1e-12)
+
+
+@pytest.mark.parametrize('cutoff', [0, 1, 2, 3])
+def test_star_matches_iterative_bp(registry, cutoff):
+    N, Nf, fv, vf, vm, nv = model_star(registry, cutoff)
+    assert detect_topology(N, Nf, fv, vf) == 'star'
+    assert_same_result(run_inference(N, Nf, fv, vf, vm, nv), iterative(N, Nf, fv, vf, vm, nv), N, fv)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_tree_matches_iterative_bp(seed):
+    N, Nf, fv, vf, vm, nv = random_tree(seed)
+    assert detect_topology(N, Nf, fv, vf) == 'tree'
+    assert_same_result(run_inference(N, Nf, fv, vf, vm, nv), iterative(N, Nf, fv, vf, vm, nv), N, fv)
+
+
+def wide_loopy_graph(n_features, n_states=3, strength=0.5, seed=1):
+    """Star over `n_features` plus n_features // 2 random feature-feature factors."""
+    rng = np.random.default_rng(seed)
+    nV = n_features + 1
+    pairs = set()
+    while len(pairs) < n_features // 2:
+        a, b = sorted(rng.choice(np.arange(1, nV), 2, replace=False))
+        pairs.add((int(a), int(b)))
+    N, Nf, t, q, vf, fv = generate_graph_weights(nV, interactions=sorted(pairs))
+    nv = {i: n_states for i in range(1, nV)}
+    nv[nV] = 2
+    vm = {}
+    for f in range(1, Nf + 1):
+        if len(fv[f]) == 2:
+            vm[f] = np.exp(strength * rng.normal(size=(nv[fv[f][0]], nv[fv[f][1]])))
+        else:
+            vm[f] = rng.uniform(0.2, 1.0, size=(nv[fv[f][0]], 1))
+    return N, Nf, fv, vf, vm, nv
+
+
+def test_log_domain_is_stable_on_wide_graphs():
+    N, Nf, fv, vf, vm, nv = wide_loopy_graph(1500)
+    _, _, marginals, _, error, underflow = run_inference(N, Nf, fv, vf, vm, nv, precision=1e-8, topology='loopy',
+                                                         log_domain=True, return_underflow=True)
+    assert error <= 1e-8
+    assert not underflow
+    for i in range(1, N + 1):
+        assert np.all(np.isfinite(marginals[i]))
+        assert np.sum(marginals[i]) == pytest.approx(1.0)
+
+    # The linear engine loses the same graph, and says so
+    with np.errstate(all='ignore'):
+        *_, underflow = run_inference(N, Nf, fv, vf, vm, nv, precision=1e-8, topology='loopy', return_underflow=True)
+    assert underflow
+
+
+def test_log_domain_matches_linear_engine_on_narrow_graphs():
+    N, Nf, fv, vf, vm, nv = wide_loopy_graph(40)
+    _, _, linear, _, _ = run_inference(N, Nf, fv, vf, vm, nv, precision=1e-10, topology='loopy')
+    _, _, log, _, _ = run_inference(N, Nf, fv, vf, vm, nv, precision=1e-10, topology='loopy', log_domain=True)
+    for i in range(1, N + 1):
+        np.testing.assert_allclose(log[i], linear[i], atol=1e-8)
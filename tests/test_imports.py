@@ -0,0 +1,26 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Must stay out of the scoring path; loaded only to parse xlsx or build DataFrames
+HEAVY_MODULES = ['pandas', 'openpyxl']
+
+FAST_PATH = """
+import json, sys
+from risk_model import ModelRegistry
+registry = ModelRegistry(results_path='Influence Scores', label_col='ASMULTIMODALORRES_E1_C18')
+model = registry.get(1)
+model.calculate_risk({'age_E1': 1, 'sex_E1_C1': 0})
+model.calculate_risk_batch([{'age_E1': 2}, {'bmi_E1_C1': 1}])
+registry.multi_cutoff().calculate_risk({'age_E1': 1})
+print(json.dumps(sorted(m for m in sys.modules if m.split('.')[0] in %r)))
+""" % (HEAVY_MODULES,)
+
+
+def test_scoring_path_needs_only_numpy():
+    # A fresh interpreter: this one has pandas loaded already
+    proc = subprocess.run([sys.executable, '-c', FAST_PATH], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert json.loads(proc.stdout.strip().splitlines()[-1]) == []
@@ -0,0 +1,51 @@
+import glob
+import os
+
+import numpy as np
+import pytest
+
+from model_format import model_path, read_influence_xlsx, read_model_file, source_matches, verify, write_model_file
+
+
+def xlsx_paths(results_dir):
+    return sorted(glob.glob(os.path.join(glob.escape(results_dir), '*.xlsx')))
+
+
+def test_round_trip_equals_xlsx(results_dir, tmp_path):
+    for xlsx_path in xlsx_paths(results_dir):
+        features, states, weights = read_influence_xlsx(xlsx_path)
+        path = str(tmp_path / 'model.via')
+        write_model_file(path, features, states, weights, source=xlsx_path)
+
+        m_features, m_states, m_weights, header = read_model_file(path)
+        assert m_features == features
+        assert m_states == states
+        assert np.array_equal(m_weights, weights)
+        assert source_matches(header, xlsx_path)
+
+
+def test_shipped_models_match_their_xlsx(results_dir):
+    paths = xlsx_paths(results_dir)
+    assert paths
+    for xlsx_path in paths:
+        assert os.path.exists(model_path(xlsx_path))
+        verify(xlsx_path) # Raises ValueError on any difference
+
+
+def test_changed_source_does_not_match(results_dir, tmp_path):
+    xlsx_path = xlsx_paths(results_dir)[0]
+    features, states, weights = read_influence_xlsx(xlsx_path)
+    source = tmp_path / 'source.xlsx'
+    source.write_bytes(b'version 1')
+    write_model_file(str(tmp_path / 'model.via'), features, states, weights, source=str(source))
+    source.write_bytes(b'version 2, edited')
+
+    _, _, _, header = read_model_file(str(tmp_path / 'model.via'))
+    assert not source_matches(header, str(source))
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / 'not_a_model.via'
+    path.write_bytes(b'PK\x03\x04 an xlsx, say')
+    with pytest.raises(ValueError):
+        read_model_file(str(path))
@@ -0,0 +1,88 @@
+import copy
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from main import patient_profile
+
+FEATURE = 'age_E1'
+
+# Profile value -> the state ID every entry point must read it as
+EQUIVALENT_IDS = [
+    (1, 1),
+    (1.0, 1),
+    (np.int64(1), 1),
+    (np.float64(1.0), 1),
+    (1.5, -1),
+    (float('nan'), -1),
+    (None, -1),
+    ('x', -1),
+    ('1', -1),
+    (10**30, -1),
+    (-1, -1),
+    (99, -1),
+]
+
+
+@pytest.fixture(scope='module')
+def model(registry):
+    return registry.get(1)
+
+
+@pytest.fixture(scope='module')
+def loopy_model(model):
+    # Same weights, scored by BP instead of the closed form
+    loopy = copy.copy(model)
+    loopy.topology = 'loopy'
+    return loopy
+
+
+def with_value(value):
+    profile = dict(patient_profile)
+    profile[FEATURE] = value
+    return profile
+
+
+def entry_point_scores(model, profile):
+    """Risk Score of one profile through every scoring entry point."""
+    base = model.infer(dict(patient_profile, **{FEATURE: 0}))
+    scores = {
+        'calculate_risk': model.calculate_risk(profile),
+        'diagnostics': model.calculate_risk(profile, diagnostics=True)[0],
+        'contributions': model.calculate_risk(profile, contributions=True)[0],
+        'batch': model.calculate_risk_batch([profile, patient_profile])[0],
+        'batch_frame': model.calculate_risk_batch(pd.DataFrame([profile, patient_profile]))[0],
+        'infer': model.infer(profile).risk,
+        'rescore': model.rescore(base, {FEATURE: profile[FEATURE]}).risk,
+    }
+    if model.topology == 'star':
+        scores['sweep'] = model.sweep_interventions(profile, [FEATURE], allowed_moves={FEATURE: []})['risk'].iloc[0]
+    return scores
+
+
+@pytest.mark.parametrize('value, state_id', EQUIVALENT_IDS)
+@pytest.mark.parametrize('topology', ['star', 'loopy'])
+def test_entry_points_agree_on_profile_values(model, loopy_model, value, state_id, topology):
+    m = model if topology == 'star' else loopy_model
+    expected = m.calculate_risk(with_value(state_id))
+    scores = entry_point_scores(m, with_value(value))
+    for name, score in scores.items():
+        assert score == pytest.approx(expected, rel=1e-9, abs=1e-12), name
+
+
+def test_missing_feature_is_unobserved(model):
+    profile = dict(patient_profile)
+    del profile[FEATURE]
+    assert model.calculate_risk(profile) == model.calculate_risk(with_value(-1))
+
+
+def test_zero_weights_are_not_underflow(registry):
+    # Stage 4 with rs429608=2 has exactly zero belief at cutoff 3: BP converges normally
+    loopy = copy.copy(registry.get(3))
+    loopy.topology = 'loopy'
+    risk, diagnostics = loopy.calculate_risk({'stage_before': 4, 'rs429608': 2}, diagnostics=True)
+    assert diagnostics.converged
+    assert diagnostics.error <= 1e-7
+    assert not diagnostics.underflow
+    assert risk == registry.get(3).calculate_risk({'stage_before': 4, 'rs429608': 2})
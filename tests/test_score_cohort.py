@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from score_cohort import score_file
+
+AGE_VALUES = [1, 2.5, 1e30, 99, -1, None]
+
+
+@pytest.mark.parametrize('cutoff', ['auto', 1])
+def test_cli_matches_calculate_risk_batch(registry, results_dir, tmp_path, cutoff):
+    cohort = pd.DataFrame({'patient': range(len(AGE_VALUES)), 'stage_before': 1, 'sex_E1_C1': 0,
+                           'age_E1': AGE_VALUES})
+    input_path, output_path = tmp_path / 'cohort.csv', tmp_path / 'risks.csv'
+    cohort.to_csv(input_path, index=False)
+
+    score_file(str(input_path), str(output_path), workers=1, cutoff=cutoff, results_dir=results_dir)
+    scored = pd.read_csv(output_path)
+
+    expected = registry.get(1).calculate_risk_batch(cohort.drop(columns='patient'))
+    np.testing.assert_allclose(scored['risk'], expected, rtol=1e-12)
+    assert scored['risk'].nunique() == 2 # State 1, or unobserved for everything else
+
+
+def test_invalid_stage_has_no_model(results_dir, tmp_path):
+    cohort = pd.DataFrame({'stage_before': [1, 1.5, 1e30], 'age_E1': 1})
+    input_path, output_path = tmp_path / 'cohort.csv', tmp_path / 'risks.csv'
+    cohort.to_csv(input_path, index=False)
+
+    score_file(str(input_path), str(output_path), workers=1, results_dir=results_dir)
+    scored = pd.read_csv(output_path)
+
+    assert scored['cutoff'].tolist() == [1, -1, -1]
+    assert scored['risk'].isna().tolist() == [False, True, True]
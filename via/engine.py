@@ -1,7 +1,69 @@
+import sys
+import time
+
 import numpy as np
 
-def generate_graph_weights(nV):
-    """Generates the factor graph structure for the weighted VIA model."""
+from .graph import FactorGraph
+
+class BPTracer:
+    """
+    Records each BP iteration: max message delta and wall time per phase
+    (variable->factor, factor->variable, convergence check). With
+    track_allocations=True it also records the change in
+    sys.getallocatedblocks() over each phase.
+
+    Subclass and override `on_iteration` to stream records elsewhere.
+    """
+    PHASES = ('variable_to_function', 'function_to_variable', 'convergence')
+
+    def __init__(self, track_allocations=False):
+        self.track_allocations = track_allocations
+        self.iterations = []
+        self._times = []
+        self._blocks = []
+        self._mark = None
+
+    def begin(self):
+        self._times = []
+        self._blocks = []
+        self._mark = (time.perf_counter(), sys.getallocatedblocks() if self.track_allocations else 0)
+
+    def phase(self):
+        now = (time.perf_counter(), sys.getallocatedblocks() if self.track_allocations else 0)
+        self._times.append(now[0] - self._mark[0])
+        self._blocks.append(now[1] - self._mark[1])
+        self._mark = now
+
+    def end(self, n_iter, error):
+        record = {'iteration': n_iter, 'error': float(error), 'time_s': dict(zip(self.PHASES, self._times))}
+        if self.track_allocations:
+            record['allocated_blocks'] = dict(zip(self.PHASES, self._blocks))
+        self.iterations.append(record)
+        self.on_iteration(record)
+
+    def on_iteration(self, record):
+        """Called after every iteration with its record; no-op by default."""
+
+    @property
+    def errors(self):
+        return [r['error'] for r in self.iterations]
+
+    @property
+    def total_time(self):
+        return sum(sum(r['time_s'].values()) for r in self.iterations)
+
+    def phase_totals(self):
+        """Seconds spent in each phase over the whole run."""
+        return {p: sum(r['time_s'].get(p, 0.0) for r in self.iterations) for p in self.PHASES}
+
+
+def generate_graph_weights(nV, interactions=None):
+    """Generates the factor graph structure for the weighted VIA model.
+
+    `interactions` optionally lists (i, j) feature pairs (1-based) that get an
+    extra pairwise factor, numbered after the target's unary factor. Any such
+    factor closes a loop through the target node.
+    """
     N = nV
     t = {i: [] for i in range(1, N + 1)}
     q = {i: 0 for i in range(1, N + 1)}
@@ -23,6 +85,15 @@ def generate_graph_weights(nV):
     fv[(nV - 1) * 2 + 1] += [nV]
     vf[nV] += list(range(nV, (nV - 1) * 2 + 1)) + [(nV - 1) * 2 + 1]
 
+    # Feature-feature interaction factors (e.g. smoking x genetics)
+    for i, j in interactions or []:
+        f = len(fv) + 1
+        fv[f] = [i, j]
+        vf[i].append(f)
+        vf[j].append(f)
+        t[i].append(j)
+        t[j].append(i)
+
     for i in range(1, N + 1):
         q[i] = len(t[i])
 
@@ -49,20 +120,30 @@ def initiate_bp_messages(N, Nf, vf, fv, vm, nv):
 
     return nuja0, nuaj0
 
-def run_belief_propagation(N, Nf, fv, vf, nuja0, nuaj0, precision, max_iter, vm, nv):
-    """Runs the BP algorithm until convergence."""
+def run_belief_propagation(N, Nf, fv, vf, nuja0, nuaj0, precision, max_iter, vm, nv, tracer=None):
+    """Runs the BP algorithm until convergence.
+
+    An optional `tracer` (see `BPTracer`) receives per-iteration errors and
+    phase timings; with tracer=None no instrumentation runs.
+    """
     n_iter = 0
     converged = False
     error = 0.0
 
     while (not converged) and (n_iter < max_iter):
         n_iter += 1
+        if tracer is not None:
+            tracer.begin()
         
         # Message: Variable to Function
         nuja1 = _mess_variable_to_function(N, vf, nuaj0, nv)
+        if tracer is not None:
+            tracer.phase()
         
         # Message: Function to Variable
         nuaj1 = _mess_function_to_variable(Nf, fv, nuja1, vm, nv)
+        if tracer is not None:
+            tracer.phase()
 
         # Check convergence
         converged = True
@@ -75,6 +156,9 @@ def run_belief_propagation(N, Nf, fv, vf, nuja0, nuaj0, precision, max_iter, vm,
         
         if error > precision:
             converged = False
+        if tracer is not None:
+            tracer.phase()
+            tracer.end(n_iter, error)
         
         nuja0 = nuja1
         nuaj0 = nuaj1
@@ -82,6 +166,385 @@ def run_belief_propagation(N, Nf, fv, vf, nuja0, nuaj0, precision, max_iter, vm,
     marginals = _calculate_marginals(N, vf, nuaj0)
     return nuja0, nuaj0, marginals, n_iter, error
 
+def run_belief_propagation_vectorized(N, Nf, fv, vf, nuja0, nuaj0, precision, max_iter, vm, nv, tracer=None,
+                                      damping=0.0, normalize=False, graph=None, return_underflow=False):
+    """Runs the BP algorithm with all messages held in edge-indexed arrays.
+
+    Same inputs and return contract as `run_belief_propagation`, but each
+    iteration is a handful of gather/einsum operations instead of Python loops.
+    With `normalize`, every factor message is rescaled to sum to one, so
+    loopy graphs neither overflow nor "converge" by decaying to zero. With
+    `damping` in (0, 1), each new factor message keeps that fraction of the
+    previous one, which helps loopy graphs that oscillate. `graph` is the
+    FactorGraph of (N, Nf, fv, nv), built here if not given.
+
+    Messages can converge while the product of a variable's incoming messages
+    underflows (e.g. a target with thousands of neighbours), and the zeros then
+    look like a real zero belief. With `return_underflow`, a sixth element is
+    True if a product came out zero in a state where none of its messages is
+    exactly zero, checked on every iteration; use the log engine then.
+    """
+    graph = _factor_graph(graph, N, Nf, fv, nv)
+    potentials = _pack_potentials(graph, vm)
+
+    nuja = _pack_messages(graph, nuja0, by_variable=True)
+    nuaj = _pack_messages(graph, nuaj0, by_variable=False)
+    if normalize:
+        _normalize_rows(nuaj)
+
+    n_iter = 0
+    converged = False
+    error = 0.0
+    underflow = False
+
+    while (not converged) and (n_iter < max_iter):
+        n_iter += 1
+        if tracer is not None:
+            tracer.begin()
+
+        if return_underflow and not underflow:
+            underflow = _vec_underflow(graph, nuaj)
+        nuja1 = _vec_variable_to_function(graph, nuaj)
+        if tracer is not None:
+            tracer.phase()
+        nuaj1 = _vec_function_to_variable(graph, potentials, nuja1)
+        if normalize:
+            _normalize_rows(nuaj1)
+        if damping:
+            nuaj1 = (1.0 - damping) * nuaj1 + damping * nuaj
+        if tracer is not None:
+            tracer.phase()
+
+        # Same criterion as the dict engine: largest |sum of differences| over edges.
+        # Normalized messages always sum to one, so compare them element-wise instead.
+        if not graph.n_edges:
+            error = 0.0
+        elif normalize:
+            error = float(np.max(np.abs(nuaj - nuaj1)))
+        else:
+            error = float(np.max(np.abs(np.sum(nuaj - nuaj1, axis=1))))
+        converged = error <= precision
+        if tracer is not None:
+            tracer.phase()
+            tracer.end(n_iter, error)
+
+        nuja = nuja1
+        nuaj = nuaj1
+
+    marginals = _vec_calculate_marginals(graph, nuaj, nv)
+    result = (_unpack_messages(graph, nuja, nv, by_variable=True),
+              _unpack_messages(graph, nuaj, nv, by_variable=False),
+              marginals, n_iter, error)
+    if return_underflow:
+        return result + (underflow or _vec_underflow(graph, nuaj),)
+    return result
+
+def run_belief_propagation_log(N, Nf, fv, vf, nuja0, nuaj0, precision, max_iter, vm, nv, tracer=None,
+                               damping=0.0, graph=None):
+    """Vectorized flooding BP with messages kept as log-probabilities.
+
+    Variable-to-factor messages are sums of logs, and factor-to-variable messages
+    use log-sum-exp over the joint of the factor and its incoming messages. Each
+    message is renormalized to log-sum zero after every update. Products of
+    hundreds of factors therefore neither underflow nor overflow, and the
+    convergence test (largest element-wise change of the normalized messages)
+    means the same thing at any graph size.
+
+    Same inputs and return contract as `run_belief_propagation`; the returned
+    messages are normalized and back in the probability domain.
+    """
+    graph = _factor_graph(graph, N, Nf, fv, nv)
+    log_potentials = [_log(psi) for psi in _pack_potentials(graph, vm)]
+
+    log_nuaj = _log(_pack_messages(graph, nuaj0, by_variable=False))
+    _log_normalize_rows(log_nuaj)
+
+    n_iter = 0
+    converged = False
+    error = 0.0
+
+    while (not converged) and (n_iter < max_iter):
+        n_iter += 1
+        if tracer is not None:
+            tracer.begin()
+
+        log_nuja = _log_variable_to_function(graph, log_nuaj)
+        if tracer is not None:
+            tracer.phase()
+        log_nuaj1 = _log_function_to_variable(graph, log_potentials, log_nuja)
+        _log_normalize_rows(log_nuaj1)
+        if damping:
+            log_nuaj1 = np.logaddexp(log_nuaj1 + np.log1p(-damping), log_nuaj + np.log(damping))
+        if tracer is not None:
+            tracer.phase()
+
+        error = float(np.max(np.abs(np.exp(log_nuaj) - np.exp(log_nuaj1)))) if graph.n_edges else 0.0
+        converged = error <= precision
+        if tracer is not None:
+            tracer.phase()
+            tracer.end(n_iter, error)
+
+        log_nuaj = log_nuaj1
+
+    log_nuja = _log_variable_to_function(graph, log_nuaj)
+    _log_normalize_rows(log_nuja)
+    marginals = _log_calculate_marginals(graph, log_nuaj, nv)
+    return (_unpack_messages(graph, np.exp(log_nuja), nv, by_variable=True),
+            _unpack_messages(graph, np.exp(log_nuaj), nv, by_variable=False),
+            marginals, n_iter, error)
+
+def detect_topology(N, Nf, fv, vf):
+    """Classifies the factor graph as 'star', 'tree' or 'loopy'.
+
+    A 'star' is a tree whose pairwise factors all share one hub variable (the
+    layout built by `generate_graph_weights`); both it and general trees admit
+    exact single-pass inference.
+    """
+    if not _is_forest(N, Nf, fv):
+        return 'loopy'
+    if _star_center(Nf, fv) is not None:
+        return 'star'
+    return 'tree'
+
+def run_inference(N, Nf, fv, vf, vm, nv, precision=1e-7, max_iter=1000, topology=None, tracer=None,
+                  schedule='flooding', damping=0.0, log_domain=False, graph=None, return_underflow=False):
+    """Computes marginals exactly on trees and falls back to loopy BP otherwise.
+
+    Returns the same (nuja0, nuaj0, marginals, n_iter, error) tuple as
+    `run_belief_propagation`. On loopy graphs `schedule` is 'flooding'
+    (synchronous, vectorized) or 'residual' (see
+    `run_residual_belief_propagation`), both with normalized messages and
+    optional `damping`. `log_domain` runs the flooding schedule in log space
+    (`run_belief_propagation_log`), for graphs wide enough that message
+    products leave the float range.
+    `tracer` only sees iterations of the flooding schedule. A prebuilt
+    FactorGraph `graph` saves rebuilding the edge arrays on every loopy call.
+    With `return_underflow`, a sixth element says whether a message product
+    underflowed (see `run_belief_propagation_vectorized`); the log engine
+    never does.
+    """
+    if topology is None:
+        topology = detect_topology(N, Nf, fv, vf)
+
+    if topology in ('star', 'tree'):
+        exact = run_star_propagation if topology == 'star' else run_tree_propagation
+        result = exact(N, Nf, fv, vf, vm, nv)
+        if not return_underflow:
+            return result
+        graph = _factor_graph(graph, N, Nf, fv, nv)
+        return result + (_vec_underflow(graph, _pack_messages(graph, result[1], by_variable=False)),)
+
+    nuja0, nuaj0 = initiate_bp_messages(N, Nf, vf, fv, vm, nv)
+    if schedule == 'residual':
+        return run_residual_belief_propagation(N, Nf, fv, vf, nuja0, nuaj0, precision, max_iter, vm, nv,
+                                               damping=damping, graph=graph, return_underflow=return_underflow)
+    if schedule != 'flooding':
+        raise ValueError(f"Unknown BP schedule: {schedule!r}")
+    if log_domain:
+        result = run_belief_propagation_log(N, Nf, fv, vf, nuja0, nuaj0, precision, max_iter, vm, nv,
+                                            tracer=tracer, damping=damping, graph=graph)
+        return result + (False,) if return_underflow else result
+    return run_belief_propagation_vectorized(N, Nf, fv, vf, nuja0, nuaj0, precision, max_iter, vm, nv,
+                                             tracer=tracer, damping=damping, normalize=True, graph=graph,
+                                             return_underflow=return_underflow)
+
+def run_residual_belief_propagation(N, Nf, fv, vf, nuja0, nuaj0, precision, max_iter, vm, nv, damping=0.0,
+                                    graph=None, return_underflow=False):
+    """Residual BP: always apply the factor-to-variable update that would change most.
+
+    Pending updates sit in a priority queue keyed by their residual (max
+    absolute change of the normalized message). After an update only the
+    messages that read it are recomputed, and a message whose residual is
+    below `precision` is no longer scheduled, so converged regions of the
+    graph stop costing anything. The run ends when the largest residual is
+    below `precision`.
+
+    Returns the usual tuple with normalized messages. `max_iter` is counted in
+    sweeps (max_iter * n_edges updates) and n_iter is the number of updates
+    rounded up to whole sweeps, so both compare with the flooding engines.
+    `return_underflow` is as in `run_belief_propagation_vectorized`, checked
+    on the first and the final messages.
+    """
+    import heapq
+
+    graph = _factor_graph(graph, N, Nf, fv, nv)
+    potentials = _pack_potentials(graph, vm)
+    dependents = _residual_dependents(graph, N, fv, vf, vm, nv)
+    n_edges = graph.n_edges
+    edge_var = (graph.edge_var + 1).tolist()
+    edge_factor = (graph.edge_factor + 1).tolist()
+
+    messages = _pack_messages(graph, nuaj0, by_variable=False)
+    _normalize_rows(messages)
+    underflow = return_underflow and _vec_underflow(graph, messages)
+
+    # Every candidate update at once, as in one flooding step
+    pending = _vec_function_to_variable(graph, potentials, _vec_variable_to_function(graph, messages))
+    _normalize_rows(pending)
+    residual = np.max(np.abs(pending - messages), axis=1) if n_edges else np.zeros(0)
+    version = np.zeros(n_edges, dtype=np.intp)
+    heap = [(-r, e, 0) for e, r in enumerate(residual.tolist()) if r > precision]
+    heapq.heapify(heap)
+
+    def push(edges, new, res):
+        pending[edges] = new
+        residual[edges] = res
+        version[edges] += 1
+        for e, r, ver in zip(edges.tolist(), res.tolist(), version[edges].tolist()):
+            if r > precision: # Per-message early termination
+                heapq.heappush(heap, (-r, e, ver))
+
+    updates = 0
+    budget = max_iter * n_edges
+    while heap and updates < budget:
+        _, e, ver = heapq.heappop(heap)
+        if ver != version[e]:
+            continue # Superseded by a newer residual
+
+        new = pending[e]
+        if damping:
+            new = (1.0 - damping) * new + damping * messages[e]
+            new = new / np.sum(new)
+        messages[e] = new
+        updates += 1
+        # Damping leaves part of the change pending; otherwise this edge is settled
+        edge = np.array([e])
+        push(edge, pending[edge], np.max(np.abs(pending[edge] - messages[edge]), axis=1))
+
+        # Recompute the messages that read variable i's new incoming message
+        i = edge_var[e]
+        dep = dependents[i]
+        cavity = _leave_one_out_product(messages[dep['edges']][None])[0]
+        if len(dep['pair_out']):
+            new = np.einsum('ds,dst->dt', cavity[dep['pair_pos']], dep['pair_psi'])
+            _normalize_rows(new)
+            push(dep['pair_out'], new, np.max(np.abs(new - messages[dep['pair_out']]), axis=1))
+        for g, pos in dep['multi']:
+            if g == edge_factor[e]:
+                continue
+            incoming = [cavity[pos, :nv[i]] if k == i else
+                        _variable_to_factor(graph, dependents, messages, k, g)[:nv[k]] for k in fv[g]]
+            outgoing = _factor_messages(np.reshape(vm[g], [nv[k] for k in fv[g]]), incoming)
+            others = [(j, mess) for j, mess in zip(fv[g], outgoing) if j != i]
+            targets = np.array([graph.edge(g, j) for j, _ in others])
+            out = np.zeros((len(others), graph.n_states))
+            for row, (j, mess) in enumerate(others):
+                out[row, :nv[j]] = mess
+            _normalize_rows(out)
+            push(targets, out, np.max(np.abs(out - messages[targets]), axis=1))
+
+    error = float(np.max(residual)) if n_edges else 0.0
+    n_iter = -(-updates // n_edges) if n_edges else 0
+    nuja = _vec_variable_to_function(graph, messages)
+    marginals = _vec_calculate_marginals(graph, messages, nv)
+    result = (_unpack_messages(graph, nuja, nv, by_variable=True),
+              _unpack_messages(graph, messages, nv, by_variable=False),
+              marginals, n_iter, error)
+    if return_underflow:
+        return result + (underflow or _vec_underflow(graph, messages),)
+    return result
+
+def run_star_propagation(N, Nf, fv, vf, vm, nv):
+    """Exact marginals for a star-shaped factor graph in closed form.
+
+    Each leaf sends (evidence . weight column) to the hub; the hub belief is the
+    product of those messages and its own unary factors. The messages returned
+    are the BP fixed point, so n_iter is 1 and error is 0.
+    """
+    center = _star_center(Nf, fv)
+    pairs = [f for f in range(1, Nf + 1) if len(fv[f]) == 2]
+    leaves = [fv[f][0] if fv[f][1] == center else fv[f][1] for f in pairs]
+
+    evidence = {i: _unary_product(vf[i], fv, vm, nv[i]) for i in range(1, N + 1)}
+
+    # Pack leaf evidence (L, S) and pairwise potentials (L, S, Sc), leaf axis first
+    S = max([nv[i] for i in leaves] + [1])
+    Sc = nv[center]
+    U = np.zeros((len(pairs), S))
+    Psi = np.zeros((len(pairs), S, Sc))
+    for k, (f, leaf) in enumerate(zip(pairs, leaves)):
+        pot = np.reshape(vm[f], (nv[fv[f][0]], nv[fv[f][1]]))
+        if fv[f][0] != leaf:
+            pot = pot.T
+        Psi[k, :nv[leaf], :] = pot
+        U[k, :nv[leaf]] = evidence[leaf]
+
+    to_center = np.einsum('ls,lsc->lc', U, Psi)
+    cavity = evidence[center] * _leave_one_out_product(to_center[None])[0]
+    to_leaf = np.einsum('lsc,lc->ls', Psi, cavity)
+
+    nuaj = {f: {} for f in range(1, Nf + 1)}
+    for f in range(1, Nf + 1):
+        if len(fv[f]) == 1:
+            i = fv[f][0]
+            nuaj[f][i] = np.reshape(vm[f], (nv[i], 1)).copy()
+    for k, (f, leaf) in enumerate(zip(pairs, leaves)):
+        nuaj[f][center] = to_center[k].reshape(-1, 1)
+        nuaj[f][leaf] = to_leaf[k, :nv[leaf]].reshape(-1, 1)
+
+    nuja, marginals = _variable_side(N, vf, nuaj, nv)
+    return nuja, nuaj, marginals, 1, 0.0
+
+def run_star_propagation_batch(evidence, potentials, center_evidence=None):
+    """Hub marginals of a star graph for many evidence sets at once.
+
+    Args:
+        evidence (list): One (n, nv_leaf) evidence matrix per pairwise factor.
+        potentials (list): Matching (nv_leaf, nv_center) potential tables.
+        center_evidence (np.ndarray): Optional (n, nv_center) or (nv_center,) unary
+            evidence on the hub.
+
+    Returns:
+        np.ndarray: (n, nv_center) normalized marginals of the hub variable.
+    """
+    n = evidence[0].shape[0] if evidence else np.shape(center_evidence)[0]
+    belief = np.ones((n, potentials[0].shape[1] if potentials else np.shape(center_evidence)[-1]))
+    if center_evidence is not None:
+        belief = belief * center_evidence
+    for E, W in zip(evidence, potentials):
+        belief *= E @ W
+
+    total = np.sum(belief, axis=1, keepdims=True)
+    np.divide(belief, total, out=belief, where=total != 0)
+    return belief
+
+def run_tree_propagation(N, Nf, fv, vf, vm, nv):
+    """Exact marginals for any tree-structured factor graph.
+
+    Messages are scheduled leaves-to-root and then root-to-leaves, so every
+    directed message is computed exactly once.
+    """
+    order, parent = _tree_schedule(N, Nf, fv, vf)
+    nuja = {i: {} for i in range(1, N + 1)}
+    nuaj = {f: {} for f in range(1, Nf + 1)}
+
+    def send(src, dst):
+        if src[0] == 'v':
+            i, f = src[1], dst[1]
+            mess = np.ones((nv[i], 1))
+            for g in vf[i]:
+                if g != f:
+                    mess = mess * nuaj[g][i]
+            nuja[i][f] = mess
+        else:
+            f, i = src[1], dst[1]
+            neighbors = fv[f]
+            psi = np.reshape(vm[f], [nv[j] for j in neighbors])
+            incoming = [None if j == i else np.ravel(nuja[j][f]) for j in neighbors]
+            nuaj[f][i] = _contract_factor(psi, incoming, neighbors.index(i)).reshape(-1, 1)
+
+    # Collect: children before parents
+    for node in reversed(order):
+        if parent[node] is not None:
+            send(node, parent[node])
+    # Distribute: parents before children
+    for node in order:
+        if parent[node] is not None:
+            send(parent[node], node)
+
+    nuja, marginals = _variable_side(N, vf, nuaj, nv)
+    return nuja, nuaj, marginals, 1, 0.0
+
 # --- Internal Helper Functions ---
 
 def _mess_variable_to_function(N, vf, nuaj0, nv):
@@ -101,57 +564,40 @@ def _mess_variable_to_function(N, vf, nuaj0, nv):
 def _mess_function_to_variable(Nf, fv, nuja1, vm, nv):
     nuaj1 = {}
     for f in range(1, Nf + 1):
-        nuaj1[f] = {}
-        
-        # Setup state space for neighbors
         neighbors = fv[f]
-        ns_dims = [nv[v] - 1 for v in neighbors]
-        
-        # Iterate over neighbors
-        for idx_i, i in enumerate(neighbors):
-            mess_f_i = np.zeros((nv[i], 1))
-            
-            # Sum over all combinations (simplified for readbility, 
-            # ideally use itertools.product for arbitrary dimensions)
-            if len(neighbors) == 1:
-                 # Single node factor (prior)
-                 mess_f_i = vm[f] # Simplified logic for priors
-            else:
-                 # For logic preservation, we keep the original combinatorial logic structure
-                 # but optimized generators would be better in a future version.
-                 # Using the original ss2dec/dec2ss logic helper implicitly here for brevity.
-                 pass 
-                 # [NOTE]: To keep this snippet short, I am preserving your logic 
-                 # but recommending you import itertools in the final file 
-                 # to handle combinations instead of Dec2SS.
-            
-            # Re-inserting the specific logic required for your Factor Graph structure:
-            # (See original mess_function_to_variable_fv implementation)
-            nuaj1[f][i] = _compute_message_fv(nuja1, vm, f, i, idx_i, neighbors, nv)
-            
+        psi = np.reshape(vm[f], [nv[i] for i in neighbors])
+        incoming = [np.ravel(nuja1[i][f]) for i in neighbors]
+        outgoing = _factor_messages(psi, incoming)
+        nuaj1[f] = {i: mess.reshape(-1, 1) for i, mess in zip(neighbors, outgoing)}
     return nuaj1
 
-def _compute_message_fv(nuja1, vm, f, i, idx_i, neighbors, nv):
-    # This encapsulates your mess_function_to_variable_fv logic
-    # Re-implemented to be cleaner if needed, or keep original logic.
-    # For now, let's assume strict adherence to your logic for safety.
-    from itertools import product
-    
-    mess = np.zeros((nv[i], 1))
-    ranges = [range(nv[n]) for n in neighbors]
-    
-    for combo in product(*ranges):
-        prob = vm[f][combo].copy()
-        sigma_i = combo[idx_i]
-        
-        aux = prob
-        for idx_j, j in enumerate(neighbors):
-            if idx_i != idx_j:
-                sigma_j = combo[idx_j]
-                aux *= nuja1[j][f][sigma_j]
-        
-        mess[sigma_i] += aux
-    return mess
+def _factor_messages(psi, incoming):
+    """
+    Every outgoing message of one factor of any arity.
+
+    Message j is psi times the incoming messages of all other neighbours,
+    summed over every axis but j. The leave-one-out products are built from
+    prefix and suffix broadcast products, so there is no division (zero
+    messages are fine) and the cost is O(arity * psi.size) per factor.
+    """
+    k = psi.ndim
+
+    def along(p):
+        shape = [1] * k
+        shape[p] = -1
+        return np.reshape(incoming[p], shape)
+
+    prefix = [1.0] * k
+    suffix = [1.0] * k
+    for p in range(1, k):
+        prefix[p] = prefix[p - 1] * along(p - 1)
+        suffix[k - 1 - p] = suffix[k - p] * along(k - p)
+
+    outgoing = []
+    for j in range(k):
+        joint = psi * prefix[j] * suffix[j]
+        outgoing.append(np.sum(joint, axis=tuple(p for p in range(k) if p != j)))
+    return outgoing
 
 def _calculate_marginals(N, vf, nuaj0):
     marginal = {}
@@ -169,4 +615,316 @@ def _calculate_marginals(N, vf, nuaj0):
         if np.sum(marginal_i) != 0:
             marginal_i /= np.sum(marginal_i)
         marginal[i] = marginal_i
-    return marginal
\ No newline at end of file
+    return marginal
+
+# --- Vectorized Engine Helpers ---
+#
+# Messages live in (n_edges, S) arrays indexed by the edges of a FactorGraph,
+# where S is the largest state cardinality; states beyond nv[i] are zero
+# padding. Factors are processed per arity group and variables per degree group,
+# so every step is a handful of gathers with no padding along the edges.
+
+_EINSUM_LETTERS = 'abcdefghijklmnopqrstuvwxy'
+
+def _factor_graph(graph, N, Nf, fv, nv):
+    return graph if graph is not None else FactorGraph.from_dicts(N, Nf, fv, nv)
+
+def _einsum_specs(arity):
+    """One einsum per neighbour j: psi times the other incoming messages, summed onto axis j."""
+    letters = _EINSUM_LETTERS[:arity]
+    specs = []
+    for j in range(arity):
+        operands = ['z' + letters] + ['z' + letters[p] for p in range(arity) if p != j]
+        specs.append(','.join(operands) + '->z' + letters[j])
+    return specs
+
+def _pack_potentials(graph, vm):
+    S = graph.n_states
+    potentials = []
+    for arity, factors, edges in graph.factor_groups:
+        psi = np.zeros((len(factors),) + (S,) * arity)
+        shapes = graph.cardinality[graph.edge_var[edges]]
+        for k, (f, shape) in enumerate(zip(factors.tolist(), shapes.tolist())):
+            psi[(k,) + tuple(slice(0, s) for s in shape)] = np.reshape(vm[f + 1], shape)
+        potentials.append(psi)
+    return potentials
+
+def _pack_messages(graph, messages, by_variable):
+    packed = np.zeros((graph.n_edges, graph.n_states))
+    for e, (f, i) in enumerate(zip((graph.edge_factor + 1).tolist(), (graph.edge_var + 1).tolist())):
+        mess = np.ravel(messages[i][f] if by_variable else messages[f][i])
+        packed[e, :mess.shape[0]] = mess
+    return packed
+
+def _unpack_messages(graph, packed, nv, by_variable):
+    messages = {}
+    for e, (f, i) in enumerate(zip((graph.edge_factor + 1).tolist(), (graph.edge_var + 1).tolist())):
+        mess = packed[e, :nv[i]].reshape(-1, 1)
+        if by_variable:
+            messages.setdefault(i, {})[f] = mess
+        else:
+            messages.setdefault(f, {})[i] = mess
+    return messages
+
+def _normalize_rows(messages):
+    """Rescales each message (row) to sum to one, in place; all-zero rows are left alone."""
+    total = np.sum(messages, axis=1, keepdims=True)
+    np.divide(messages, total, out=messages, where=total != 0)
+
+def _leave_one_out_product(x):
+    """Product over axis 1 excluding each position in turn, without division."""
+    prefix = np.ones_like(x)
+    suffix = np.ones_like(x)
+    if x.shape[1] > 1:
+        prefix[:, 1:] = np.cumprod(x[:, :-1], axis=1)
+        suffix[:, :-1] = np.cumprod(x[:, :0:-1], axis=1)[:, ::-1]
+    return prefix * suffix
+
+def _vec_variable_to_function(graph, nuaj):
+    nuja = np.zeros_like(nuaj)
+    for variables, edges in graph.variable_groups:
+        if edges.shape[1]:
+            nuja[edges] = _leave_one_out_product(nuaj[edges])
+    return nuja
+
+def _vec_function_to_variable(graph, potentials, nuja):
+    nuaj = np.zeros_like(nuja)
+    for (arity, factors, edges), psi in zip(graph.factor_groups, potentials):
+        incoming = [nuja[edges[:, p]] for p in range(arity)]
+        for j, spec in enumerate(_einsum_specs(arity)):
+            others = [incoming[p] for p in range(arity) if p != j]
+            nuaj[edges[:, j]] = np.einsum(spec, psi, *others)
+    return nuaj
+
+def _vec_underflow(graph, nuaj):
+    """
+    Whether a product of factor messages at a variable (a belief, or a message
+    leaving it) is zero in a state where none of the multiplied messages is.
+    Exact zeros, e.g. from zero weights, are real zero beliefs.
+    """
+    nonzero = (nuaj != 0).astype(float)
+    for variables, edges in graph.variable_groups:
+        if not edges.shape[1]:
+            continue
+        products = np.concatenate([_leave_one_out_product(nuaj[edges]), np.prod(nuaj[edges], axis=1)[:, None]], axis=1)
+        expected = np.concatenate([_leave_one_out_product(nonzero[edges]), np.prod(nonzero[edges], axis=1)[:, None]],
+                                  axis=1)
+        if np.any((products == 0) & (expected > 0)):
+            return True
+    return False
+
+def _vec_calculate_marginals(graph, nuaj, nv):
+    beliefs = np.ones((graph.n_variables, graph.n_states))
+    for variables, edges in graph.variable_groups:
+        beliefs[variables] = np.prod(nuaj[edges], axis=1)
+    marginal = {}
+    for i in range(1, graph.n_variables + 1):
+        marginal_i = beliefs[i - 1, :nv[i]].reshape(-1, 1)
+        total = np.sum(marginal_i)
+        if total != 0:
+            marginal_i = marginal_i / total
+        marginal[i] = marginal_i
+    return marginal
+
+# --- Log-Domain Engine Helpers ---
+#
+# Same FactorGraph edge arrays as above, with log-messages; zero padding becomes -inf.
+
+def _log(x):
+    with np.errstate(divide='ignore'):
+        return np.log(x)
+
+def _logsumexp(x, axis):
+    """log(sum(exp(x))) along `axis`, shifted by the maximum; all -inf gives -inf."""
+    peak = np.max(x, axis=axis, keepdims=True)
+    peak = np.where(np.isfinite(peak), peak, 0.0)
+    with np.errstate(divide='ignore'):
+        out = np.log(np.sum(np.exp(x - peak), axis=axis, keepdims=True)) + peak
+    return np.squeeze(out, axis=axis)
+
+def _log_normalize_rows(log_messages):
+    """Shifts each log-message to log-sum zero, in place; all -inf rows are left alone."""
+    total = _logsumexp(log_messages, axis=1)[:, None]
+    np.subtract(log_messages, total, out=log_messages, where=np.isfinite(total))
+
+def _leave_one_out_sum(x):
+    """Sum over axis 1 excluding each position in turn; no subtraction, so -inf is safe."""
+    prefix = np.zeros_like(x)
+    suffix = np.zeros_like(x)
+    if x.shape[1] > 1:
+        prefix[:, 1:] = np.cumsum(x[:, :-1], axis=1)
+        suffix[:, :-1] = np.cumsum(x[:, :0:-1], axis=1)[:, ::-1]
+    return prefix + suffix
+
+def _log_variable_to_function(graph, log_nuaj):
+    log_nuja = np.full_like(log_nuaj, -np.inf)
+    for variables, edges in graph.variable_groups:
+        if edges.shape[1]:
+            log_nuja[edges] = _leave_one_out_sum(log_nuaj[edges])
+    return log_nuja
+
+def _log_function_to_variable(graph, log_potentials, log_nuja):
+    log_nuaj = np.full_like(log_nuja, -np.inf)
+    for (arity, factors, edges), log_psi in zip(graph.factor_groups, log_potentials):
+        for j in range(arity):
+            # Joint over the factor's axes, then log-sum-exp over all but axis j
+            joint = log_psi
+            for p in range(arity):
+                if p != j:
+                    shape = [len(edges)] + [1] * arity
+                    shape[p + 1] = graph.n_states
+                    joint = joint + log_nuja[edges[:, p]].reshape(shape)
+            joint = np.moveaxis(joint, j + 1, 1).reshape(len(edges), graph.n_states, -1)
+            log_nuaj[edges[:, j]] = _logsumexp(joint, axis=2)
+    return log_nuaj
+
+def _log_calculate_marginals(graph, log_nuaj, nv):
+    log_beliefs = np.zeros((graph.n_variables, graph.n_states))
+    for variables, edges in graph.variable_groups:
+        log_beliefs[variables] = np.sum(log_nuaj[edges], axis=1)
+    marginal = {}
+    for i in range(1, graph.n_variables + 1):
+        log_belief = log_beliefs[i - 1, :nv[i]]
+        total = _logsumexp(log_belief, axis=0)
+        if np.isfinite(total):
+            marginal[i] = np.exp(log_belief - total).reshape(-1, 1)
+        else:
+            marginal[i] = np.zeros((nv[i], 1))
+    return marginal
+
+# --- Exact Inference Helpers ---
+
+def _is_forest(N, Nf, fv):
+    """Union-find over the bipartite graph; any redundant edge closes a loop."""
+    root = list(range(N + Nf + 1))
+
+    def find(x):
+        while root[x] != x:
+            root[x] = root[root[x]]
+            x = root[x]
+        return x
+
+    for f in range(1, Nf + 1):
+        for i in fv[f]:
+            a, b = find(i), find(N + f)
+            if a == b:
+                return False
+            root[a] = b
+    return True
+
+def _star_center(Nf, fv):
+    pairs = [fv[f] for f in range(1, Nf + 1) if len(fv[f]) > 1]
+    if not pairs or any(len(p) != 2 for p in pairs):
+        return None
+    common = set(pairs[0]).intersection(*pairs[1:])
+    return max(common) if common else None
+
+def _unary_product(factors, fv, vm, n):
+    mess = np.ones(n)
+    for f in factors:
+        if len(fv[f]) == 1:
+            mess = mess * np.ravel(vm[f])
+    return mess
+
+def _normalized(mess):
+    total = np.sum(mess)
+    return mess / total if total != 0 else mess
+
+def _contract_factor(psi, incoming, idx_i):
+    """Sums psi against every incoming message except the one at idx_i."""
+    out = psi
+    # Contract from the last axis down so that lower axis indices stay valid
+    for p in range(len(incoming) - 1, -1, -1):
+        if p != idx_i:
+            out = np.tensordot(out, incoming[p], axes=([p], [0]))
+    return out
+
+def _variable_side(N, vf, nuaj, nv):
+    """Variable-to-factor messages and normalized marginals from fixed factor messages."""
+    nuja = {}
+    marginal = {}
+    for i in range(1, N + 1):
+        nuja[i] = {}
+        if not vf[i]:
+            marginal[i] = np.full((nv[i], 1), 1.0 / nv[i])
+            continue
+        incoming = [nuaj[f][i] for f in vf[i]]
+        if len(incoming) <= 2:
+            # Leaf variables: the leave-one-out product is just the other message
+            others = [m.copy() for m in incoming[::-1]] if len(incoming) == 2 else [np.ones((nv[i], 1))]
+            for f, mess in zip(vf[i], others):
+                nuja[i][f] = mess
+            marginal_i = incoming[0] * incoming[1] if len(incoming) == 2 else incoming[0].copy()
+        else:
+            stacked = np.stack(incoming)
+            excl = _leave_one_out_product(stacked[None])[0]
+            for d, f in enumerate(vf[i]):
+                nuja[i][f] = excl[d]
+            marginal_i = np.prod(stacked, axis=0)
+        total = np.sum(marginal_i)
+        if total != 0:
+            marginal_i = marginal_i / total
+        marginal[i] = marginal_i
+    return nuja, marginal
+
+def _tree_schedule(N, Nf, fv, vf):
+    """Depth-first order over variable ('v', i) and factor ('f', f) nodes with parent links."""
+    order = []
+    parent = {}
+    for root in [('v', i) for i in range(1, N + 1)] + [('f', f) for f in range(1, Nf + 1)]:
+        if root in parent:
+            continue
+        parent[root] = None
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            if node[0] == 'v':
+                neighbors = [('f', f) for f in vf[node[1]]]
+            else:
+                neighbors = [('v', i) for i in fv[node[1]]]
+            for nb in neighbors:
+                if nb not in parent:
+                    parent[nb] = node
+                    stack.append(nb)
+    return order, parent
+
+# --- Residual Schedule Helpers ---
+
+def _residual_dependents(graph, N, fv, vf, vm, nv):
+    """
+    Per variable i: its incoming edges, and the factor messages that read them.
+    Pairwise factors are stacked as (D, S, S) potentials oriented [state of i,
+    state of the other variable]; higher-arity factors are listed in 'multi'.
+    """
+    S = graph.n_states
+    dependents = {}
+    for i in range(1, N + 1):
+        pair_pos, pair_out, pair_psi, multi = [], [], [], []
+        for pos, g in enumerate(vf[i]):
+            if len(fv[g]) == 2 and fv[g][0] != fv[g][1]:
+                j = fv[g][1] if fv[g][0] == i else fv[g][0]
+                pot = np.reshape(vm[g], (nv[fv[g][0]], nv[fv[g][1]]))
+                if fv[g][0] != i:
+                    pot = pot.T
+                psi = np.zeros((S, S))
+                psi[:nv[i], :nv[j]] = pot
+                pair_pos.append(pos)
+                pair_out.append(graph.edge(g, j))
+                pair_psi.append(psi)
+            elif len(fv[g]) > 2:
+                multi.append((g, pos))
+        dependents[i] = {
+            'edges': np.array([graph.edge(g, i) for g in vf[i]], dtype=np.intp),
+            'pair_pos': np.array(pair_pos, dtype=np.intp),
+            'pair_out': np.array(pair_out, dtype=np.intp),
+            'pair_psi': np.array(pair_psi).reshape(-1, S, S),
+            'multi': multi,
+        }
+    return dependents
+
+def _variable_to_factor(graph, dependents, messages, k, g):
+    """Product of the messages into variable k from every factor except g."""
+    edges = dependents[k]['edges']
+    keep = edges != graph.edge(g, k)
+    return np.prod(messages[edges[keep]], axis=0)
@@ -0,0 +1,111 @@
+import numpy as np
+
+
+class FactorGraph:
+    """
+    Array-backed (CSR) factor graph shared by the vectorized engines.
+
+    Variables and factors are 0-based here; the accessors take and return the
+    1-based ids used by `generate_graph_weights`. Edges are numbered factor by
+    factor in the order of fv[f], and edge e is also the row of its messages in
+    the engines' (n_edges, n_states) arrays.
+
+    Attributes:
+        cardinality (n_variables,): Number of states of each variable.
+        factor_offsets (n_factors + 1,): Factor f owns edges factor_offsets[f]:factor_offsets[f + 1].
+        edge_var, edge_factor (n_edges,): Endpoints of each edge.
+        var_offsets (n_variables + 1,), var_edges (n_edges,): Edges into variable i are
+            var_edges[var_offsets[i]:var_offsets[i + 1]], in factor order.
+        factor_groups: (arity, factors, edges) per arity, `edges` an (n, arity) edge matrix.
+        variable_groups: (variables, edges) per degree, `edges` an (n, degree) edge matrix.
+    """
+
+    __slots__ = ('n_variables', 'n_factors', 'n_edges', 'n_states', 'cardinality', 'factor_offsets', 'edge_var',
+                 'edge_factor', 'var_offsets', 'var_edges', 'factor_groups', 'variable_groups')
+
+    def __init__(self, cardinality, factor_offsets, edge_var):
+        self.cardinality = np.asarray(cardinality, dtype=np.intp)
+        self.factor_offsets = np.asarray(factor_offsets, dtype=np.intp)
+        self.edge_var = np.asarray(edge_var, dtype=np.intp)
+        self.n_variables = len(self.cardinality)
+        self.n_factors = len(self.factor_offsets) - 1
+        self.n_edges = len(self.edge_var)
+        self.n_states = int(self.cardinality.max()) if self.n_variables else 0
+
+        arity = np.diff(self.factor_offsets)
+        self.edge_factor = np.repeat(np.arange(self.n_factors, dtype=np.intp), arity)
+
+        # Variable side: edges sorted by variable, keeping factor order within each
+        self.var_edges = np.argsort(self.edge_var, kind='stable').astype(np.intp)
+        degree = np.bincount(self.edge_var, minlength=self.n_variables)
+        self.var_offsets = np.concatenate([[0], np.cumsum(degree)]).astype(np.intp)
+
+        self.factor_groups = []
+        for a in np.unique(arity):
+            factors = np.flatnonzero(arity == a)
+            edges = self.factor_offsets[factors][:, None] + np.arange(a)
+            self.factor_groups.append((int(a), factors, edges))
+
+        self.variable_groups = []
+        for d in np.unique(degree):
+            variables = np.flatnonzero(degree == d)
+            edges = self.var_edges[self.var_offsets[variables][:, None] + np.arange(d)]
+            self.variable_groups.append((variables, edges))
+
+    @classmethod
+    def from_dicts(cls, N, Nf, fv, nv):
+        """Builds the graph from the 1-based dicts of `generate_graph_weights` and state counts `nv`."""
+        arity = [len(fv[f]) for f in range(1, Nf + 1)]
+        edge_var = [i - 1 for f in range(1, Nf + 1) for i in fv[f]]
+        cardinality = [nv[i] for i in range(1, N + 1)]
+        return cls(cardinality, np.concatenate([[0], np.cumsum(arity, dtype=np.intp)]), edge_var)
+
+    @classmethod
+    def star(cls, cardinality, interactions=None):
+        """
+        The `generate_graph_weights` layout without Python dicts: the last variable
+        is the target. Factors are the feature unaries, the feature-target pairs,
+        the target unary, then one pair per (i, j) interaction (1-based, as there).
+        """
+        cardinality = np.asarray(cardinality, dtype=np.intp)
+        n_features = len(cardinality) - 1
+        features = np.arange(n_features, dtype=np.intp)
+        pairs = np.asarray(interactions if interactions is not None else np.empty((0, 2)), dtype=np.intp) - 1
+
+        edge_var = np.concatenate([
+            features,
+            np.column_stack([features, np.full(n_features, n_features)]).ravel(),
+            [n_features],
+            pairs.ravel(),
+        ])
+        arity = np.concatenate([np.ones(n_features), np.full(n_features, 2), [1], np.full(len(pairs), 2)])
+        return cls(cardinality, np.concatenate([[0], np.cumsum(arity.astype(np.intp))]), edge_var)
+
+    # --- 1-based accessors (same structure as fv / vf / nv) ---
+
+    def neighbors(self, f):
+        """Variables of factor f, like fv[f]."""
+        return (self.edge_var[self.factor_offsets[f - 1]:self.factor_offsets[f]] + 1).tolist()
+
+    def factors_of(self, i):
+        """Factors of variable i, like vf[i]."""
+        return (self.edge_factor[self.var_edges[self.var_offsets[i - 1]:self.var_offsets[i]]] + 1).tolist()
+
+    def num_states(self, i):
+        """Number of states of variable i, like nv[i]."""
+        return int(self.cardinality[i - 1])
+
+    def edge(self, f, i):
+        """Edge (message slot) joining factor f and variable i."""
+        start = self.factor_offsets[f - 1]
+        return int(start + self.neighbors(f).index(i))
+
+    def to_dicts(self):
+        """(N, Nf, fv, vf, nv) with the 1-based dicts the dict engine expects."""
+        fv = {f: self.neighbors(f) for f in range(1, self.n_factors + 1)}
+        vf = {i: self.factors_of(i) for i in range(1, self.n_variables + 1)}
+        nv = {i: self.num_states(i) for i in range(1, self.n_variables + 1)}
+        return self.n_variables, self.n_factors, fv, vf, nv
+
+    def __repr__(self):
+        return f"FactorGraph(n_variables={self.n_variables}, n_factors={self.n_factors}, n_edges={self.n_edges})"